@@ -0,0 +1,109 @@
+from occupancy import NO_SHIFT, count_occupancy
+
+
+# ---------------- AUTO-FILL ----------------
+# Раскладка свободных мест по лимитам недели: жадно, потом ремонт.
+#   Спрос — лимиты (date, slot, role) минус уже занятые места; дневной лимит
+#   (date, None, role) — если на этот день и роль нет лимитов по слотам, места
+#   раскладываются по слотам равномерно.
+#   Кандидат — активный сотрудник нужной роли, у которого в этот день ещё нет
+#   записи (смены или выходного), день не в days_off и рабочих дней меньше max_days.
+#   Жадно: сначала самые «дефицитные» пары (день, роль), место получает наименее
+#   загруженный кандидат. Ремонт: если кандидатов нет, ищем сотрудника, упёршегося
+#   в max_days, и отдаём одну из его авто-смен в другой день тому, кто свободен.
+# Уже стоящие смены не трогаются. Результат — {"assign": [строки shifts],
+# "unfilled": [(date, slot, role, не хватает)]}.
+def auto_fill(dates: list, members: list, shifts: list, limits: list, slots: list,
+              max_days: int = 5, user_max_days: dict = None, days_off: dict = None) -> dict:
+    user_max_days = user_max_days or {}
+    days_off = days_off or {}
+    dates = set(dates)
+    shifts = [s for s in shifts if s["date"] in dates]
+    active = [u for u in members if u.get("is_active", True) and u.get("role")]
+    by_role = {}
+    for u in active:
+        by_role.setdefault(u["role"], []).append(u["id"])
+
+    busy = {(s["user_id"], s["date"]) for s in shifts}
+    load = {u["id"]: 0 for u in active}
+    for s in shifts:
+        if s["user_id"] in load and (s["slot"] or "").strip() not in NO_SHIFT:
+            load[s["user_id"]] += 1
+    cap = {uid: user_max_days.get(uid, max_days) for uid in load}
+    counts = count_occupancy(shifts, members)
+    auto = {}       # (user_id, date) -> slot, назначенные здесь
+
+    # --- спрос ---
+    need = {}       # (date, slot, role) -> сколько не хватает
+    slotted = {(r["date"], r["role"]) for r in limits if r["slot"] is not None}
+    for r in limits:
+        if r["date"] not in dates or r["role"] not in by_role:
+            continue
+        if r["slot"] is not None:
+            key = (r["date"], r["slot"], r["role"])
+            if r["slot"] not in NO_SHIFT and r["max_count"] > counts.get(key, 0):
+                need[key] = r["max_count"] - counts.get(key, 0)
+        elif (r["date"], r["role"]) not in slotted:
+            missing = r["max_count"] - counts.get((r["date"], None, r["role"]), 0)
+            for i in range(max(missing, 0)):
+                # дневной лимит: по слотам, где этой роли сейчас меньше всего
+                slot = min(slots, key=lambda s: (counts.get((r["date"], s, r["role"]), 0), slots.index(s)))
+                counts[(r["date"], slot, r["role"])] = counts.get((r["date"], slot, r["role"]), 0) + 1
+                need[(r["date"], slot, r["role"])] = need.get((r["date"], slot, r["role"]), 0) + 1
+
+    def free(uid: str, date: str) -> bool:
+        return (uid, date) not in busy and date not in days_off.get(uid, ()) and load[uid] < cap[uid]
+
+    def take(uid: str, date: str, slot: str):
+        busy.add((uid, date))
+        load[uid] += 1
+        auto[(uid, date)] = slot
+
+    # --- жадно: сначала пары (день, роль), где кандидатов меньше всего на место ---
+    demand = {}
+    for (date, slot, role), n in need.items():
+        demand[(date, role)] = demand.get((date, role), 0) + n
+    scarcity = {(date, role): sum(free(uid, date) for uid in by_role[role]) - n
+                for (date, role), n in demand.items()}
+    unfilled, stuck = [], set()     # stuck — (день, роль), где ремонт уже не помог
+    for date, slot, role in sorted(need, key=lambda k: (scarcity[(k[0], k[2])], k)):
+        for _ in range(need[(date, slot, role)]):
+            candidates = [uid for uid in by_role[role] if free(uid, date)]
+            if candidates:
+                take(min(candidates, key=load.__getitem__), date, slot)
+            elif (date, role) in stuck or not _repair(by_role[role], date, slot, busy, load, cap, days_off, auto):
+                # назначения дальше только занимают людей — повторный ремонт не поможет
+                stuck.add((date, role))
+                unfilled.append((date, slot, role))
+
+    missing = {}
+    for key in unfilled:
+        missing[key] = missing.get(key, 0) + 1
+    return {
+        "assign": [{"user_id": uid, "date": date, "slot": slot} for (uid, date), slot in sorted(auto.items())],
+        "unfilled": sorted((date, slot, role, n) for (date, slot, role), n in missing.items()),
+    }
+
+
+def _repair(role_users: list, date: str, slot: str, busy: set, load: dict, cap: dict,
+            days_off: dict, auto: dict) -> bool:
+    # u свободен в date, но выбрал max_days; его авто-смену в другой день d2
+    # забирает v, у которого d2 свободен, — и u встаёт на (date, slot)
+    for uid in role_users:
+        if (uid, date) in busy or date in days_off.get(uid, ()) or load[uid] < cap[uid]:
+            continue
+        for (owner, d2), s2 in list(auto.items()):
+            if owner != uid:
+                continue
+            for vid in role_users:
+                if vid != uid and (vid, d2) not in busy and d2 not in days_off.get(vid, ()) \
+                        and load[vid] < cap[vid]:
+                    del auto[(uid, d2)]
+                    busy.discard((uid, d2))
+                    busy.add((vid, d2))
+                    auto[(vid, d2)] = s2
+                    load[vid] += 1
+                    busy.add((uid, date))
+                    auto[(uid, date)] = slot
+                    return True
+    return False
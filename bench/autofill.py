@@ -0,0 +1,100 @@
+"""Бенчмарк автозаполнения недели (autofill.auto_fill).
+
+Синтетическая команда: сотрудники по ролям, лимиты на каждый (день, слот, роль),
+часть смен уже забронирована, у части сотрудников выходные. Проверяется, что
+раскладка не превышает лимиты, не ставит двух смен в день и не нарушает
+max_days / days_off, и что она укладывается в бюджет времени.
+
+Запуск из корня репозитория:
+    python -m bench.autofill --staff 100 --repeat 20
+"""
+import argparse
+import random
+import time
+from datetime import date, timedelta
+
+from autofill import auto_fill
+from occupancy import NO_SHIFT, count_occupancy
+
+SLOTS = ["09:30-23:00", "10:00-23:00", "11:00-23:00", "12:00-23:00", "13:00-23:00", "17:00-23:00"]
+ROLES = ["employee", "employee", "employee", "host", "barman", "runner", "trainee"]
+WEEK_START = date(2025, 8, 18)
+
+
+def make_team(staff: int, days: int, seed: int = 1):
+    rnd = random.Random(seed)
+    dates = [(WEEK_START + timedelta(days=i)).isoformat() for i in range(days)]
+    members = [{"id": f"u{i:04d}", "name": f"User {i:04d}", "role": ROLES[i % len(ROLES)], "is_active": True}
+               for i in range(staff)]
+    per_role = {}
+    for u in members:
+        per_role[u["role"]] = per_role.get(u["role"], 0) + 1
+    # спрос примерно на 4.5 рабочих дня на человека — часть упрётся в max_days
+    limits = []
+    for d in dates:
+        for role, n in per_role.items():
+            total = round(n * 4.5 / 7)
+            for i, s in enumerate(SLOTS):
+                limits.append({"date": d, "slot": s, "role": role,
+                               "max_count": total // len(SLOTS) + (1 if i < total % len(SLOTS) else 0)})
+    shifts, days_off = [], {}
+    for u in members:
+        for d in dates:
+            r = rnd.random()
+            if r < 0.10:
+                shifts.append({"user_id": u["id"], "date": d, "slot": rnd.choice(SLOTS)})
+            elif r < 0.15:
+                shifts.append({"user_id": u["id"], "date": d, "slot": "выходной"})
+            elif r < 0.20:
+                days_off.setdefault(u["id"], set()).add(d)
+    return dates, members, shifts, limits, days_off
+
+
+def check(result: dict, members, shifts, limits, days_off, max_days: int):
+    merged = shifts + result["assign"]
+    keys = [(s["user_id"], s["date"]) for s in merged]
+    assert len(keys) == len(set(keys)), "две смены в один день"
+    before, counts = count_occupancy(shifts, members), count_occupancy(merged, members)
+    for r in limits:
+        key = (r["date"], r["slot"], r["role"])
+        # случайные брони могли уже превысить лимит — раскладка не должна добавлять сверх него
+        assert counts.get(key, 0) <= max(r["max_count"], before.get(key, 0)), "превышен лимит"
+    work = {}
+    for s in merged:
+        if s["slot"] not in NO_SHIFT:
+            work[s["user_id"]] = work.get(s["user_id"], 0) + 1
+    for s in result["assign"]:
+        assert s["date"] not in days_off.get(s["user_id"], ()), "смена в выходной"
+        assert work[s["user_id"]] <= max_days, "больше max_days"
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--staff", type=int, default=100)
+    p.add_argument("--days", type=int, default=7)
+    p.add_argument("--max-days", type=int, default=5)
+    p.add_argument("--repeat", type=int, default=20)
+    p.add_argument("--budget", type=float, default=1.0, help="секунд на одну раскладку")
+    args = p.parse_args()
+
+    dates, members, shifts, limits, days_off = make_team(args.staff, args.days)
+    times = []
+    for _ in range(args.repeat):
+        t0 = time.perf_counter()
+        result = auto_fill(dates, members, shifts, limits, SLOTS, max_days=args.max_days, days_off=days_off)
+        times.append(time.perf_counter() - t0)
+    check(result, members, shifts, limits, days_off, args.max_days)
+
+    demand = sum(r["max_count"] for r in limits)
+    taken = sum(1 for s in shifts if s["slot"] not in NO_SHIFT)
+    missing = sum(n for *_, n in result["unfilled"])
+    times.sort()
+    print(f"staff={args.staff} days={args.days} slots={len(SLOTS)}  мест по лимитам={demand} "
+          f"уже занято={taken} назначено={len(result['assign'])} не закрыто={missing}")
+    print(f"auto_fill: median {times[len(times) // 2] * 1000:.1f} ms  max {times[-1] * 1000:.1f} ms "
+          f"(бюджет {args.budget * 1000:.0f} ms)")
+    assert times[-1] < args.budget, "раскладка не уложилась в бюджет"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""Гонка бронирований: N сотрудников одновременно берут слот с лимитом K.
+
+Успешных бронирований должно быть ровно min(N, K) — не больше.
+
+Без аргументов гонка идёт через Repo против in-memory заглушки:
+    python -m bench.booking_race --n 50 --k 5
+Это проверка обвязки (Repo, пул потоков, разбор ответа), а не SQL: заглушка
+выполняет book_shift под общим локом и перебронировать не может в принципе.
+Атомарность sql/002_book_shift.sql проверяет только прогон с --dsn.
+
+С --dsn — против локального Postgres (нужен пакет psycopg, база должна быть
+пустой/тестовой: скрипт создаёт минимальные таблицы и применяет sql/*.sql):
+    python -m bench.booking_race --dsn postgresql://postgres@localhost/autografik_test
+"""
+import argparse
+import asyncio
+import threading
+import time
+from pathlib import Path
+from uuid import uuid4
+
+from bench.fake_supabase import FakeSupabase
+from repo import Repo
+
+DATE = "2025-08-18"
+WEEK_END = "2025-08-24"
+SLOT = "10:00-23:00"
+ROOT = Path(__file__).resolve().parent.parent
+
+SCHEMA = """
+create table if not exists public.users (
+    id uuid primary key, telegram_id bigint, name text, team_id uuid,
+    role text, is_admin boolean default false, is_owner boolean default false, is_active boolean default true
+);
+create table if not exists public.limits (
+    id uuid primary key default gen_random_uuid(), team_id uuid, date date, slot text, role text, max_count int
+);
+create table if not exists public.weeks (
+    id uuid primary key default gen_random_uuid(), team_id uuid, start_date date, end_date date,
+    is_active boolean default true, is_frozen boolean default false
+);
+create table if not exists public.shifts (
+    id uuid primary key default gen_random_uuid(), team_id uuid, user_id uuid, date date, slot text
+);
+"""
+
+
+def race_fake(n: int, k: int, latency: float) -> int:
+    client = FakeSupabase(latency=latency)
+    team_id = str(uuid4())
+    users = [{"id": str(uuid4()), "team_id": team_id, "role": "employee", "is_active": True} for _ in range(n)]
+    client.tables["users"] = users
+    client.tables["limits"] = [{"id": "l1", "team_id": team_id, "date": DATE, "slot": SLOT, "role": "employee", "max_count": k}]
+    client.tables["weeks"] = [{"id": "w1", "team_id": team_id, "start_date": DATE, "end_date": WEEK_END,
+                               "is_active": True, "is_frozen": False}]
+
+    async def run():
+        db = Repo(client, workers=n)
+        res = await asyncio.gather(*(db.book_shift(team_id, u["id"], DATE, SLOT) for u in users))
+        db.close()
+        return res
+
+    res = asyncio.run(run())
+    booked = sum(1 for s in client.tables["shifts"] if s["slot"] == SLOT)
+    assert booked == sum(1 for r in res if r["ok"])
+    return booked
+
+
+def race_postgres(dsn: str, n: int, k: int) -> int:
+    import psycopg
+
+    with psycopg.connect(dsn, autocommit=True) as conn:
+        conn.execute(SCHEMA)
+        for path in sorted((ROOT / "sql").glob("*.sql")):
+            conn.execute(path.read_text(encoding="utf-8"))
+        team_id = uuid4()
+        users = [uuid4() for _ in range(n)]
+        with conn.cursor() as cur:
+            cur.executemany("insert into public.users (id, team_id, role) values (%s, %s, 'employee')",
+                            [(u, team_id) for u in users])
+            cur.execute("insert into public.weeks (team_id, start_date, end_date) values (%s, %s, %s)",
+                        (team_id, DATE, WEEK_END))
+            cur.execute("insert into public.limits (team_id, date, slot, role, max_count) values (%s, %s, %s, 'employee', %s)",
+                        (team_id, DATE, SLOT, k))
+
+    barrier = threading.Barrier(n)
+
+    def worker(user_id):
+        with psycopg.connect(dsn, autocommit=True) as c:
+            barrier.wait()
+            c.execute("select public.book_shift(%s, %s, %s, %s)", (team_id, user_id, DATE, SLOT))
+
+    threads = [threading.Thread(target=worker, args=(u,)) for u in users]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    with psycopg.connect(dsn) as conn:
+        return conn.execute("select count(*) from public.shifts where team_id = %s and date = %s and slot = %s",
+                            (team_id, DATE, SLOT)).fetchone()[0]
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--n", type=int, default=50)
+    p.add_argument("--k", type=int, default=5)
+    p.add_argument("--latency", type=float, default=0.01)
+    p.add_argument("--dsn")
+    args = p.parse_args()
+
+    t0 = time.perf_counter()
+    booked = race_postgres(args.dsn, args.n, args.k) if args.dsn else race_fake(args.n, args.k, args.latency)
+    elapsed = (time.perf_counter() - t0) * 1000
+    expected = min(args.n, args.k)
+    print(f"backend={'postgres' if args.dsn else 'fake'} n={args.n} k={args.k} booked={booked} ({elapsed:.0f} ms)")
+    if booked != expected:
+        raise SystemExit(f"FAIL: booked {booked}, expected {expected}")
+    if args.dsn:
+        print("OK: overbooking impossible")
+    else:
+        print("OK: Repo/RPC plumbing works. The fake runs book_shift under one global lock, "
+              "so this does NOT test the SQL — use --dsn against Postgres for that")
+
+
+if __name__ == "__main__":
+    main()
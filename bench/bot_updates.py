@@ -0,0 +1,181 @@
+"""Сквозной бенчмарк бота: синтетические апдейты через dp.feed_update.
+
+Апдейты (Message / CallbackQuery) проходят весь путь — middleware, фильтры,
+FSM, хендлеры, Repo, рендер — против in-memory заглушки Supabase и сессии
+бота без сети. Сценарии:
+    schedule — «понедельничный наплыв»: все сотрудники открывают расписание
+    booking  — все сотрудники одновременно бронируют один слот с лимитом
+               LIMIT_PER_SLOT: ровно столько броней проходит, остальным отказ
+    admin    — админ массово правит смены через inline-кнопки
+
+Запуск из корня репозитория:
+    python -m bench.bot_updates --users 100 --concurrency 20 --db-latency 0.01 --tg-latency 0.03
+    python -m bench.bot_updates --scenario booking
+"""
+import argparse
+import asyncio
+import os
+import time
+from datetime import datetime
+from itertools import count
+
+os.environ.setdefault("TELEGRAM_TOKEN", "123456:BENCH")
+os.environ.setdefault("SUPABASE_URL", "http://localhost:1")
+os.environ.setdefault("SUPABASE_KEY", "bench")
+os.environ["FSM_STORAGE"] = "memory"
+os.environ["METRICS_PORT"] = "0"
+
+from aiogram import Bot                      # noqa: E402
+from aiogram.types import Update             # noqa: E402
+
+import bot as app                            # noqa: E402
+from bench.fake_supabase import FakeSupabase  # noqa: E402
+from bench.fake_telegram import FakeSession  # noqa: E402
+
+TEAM = "team-bench"
+WEEK = ("2025-08-18", "2025-08-24")
+ADMIN_TG = 1
+LIMIT_PER_SLOT = 3
+_update_ids = count(1)
+
+
+def seed(client: FakeSupabase, users: int):
+    client.tables["teams"] = [{"id": TEAM, "name": "Bench", "invite_code": "BENCH"}]
+    client.tables["weeks"] = [{"id": "week-bench", "team_id": TEAM, "start_date": WEEK[0],
+                               "end_date": WEEK[1], "is_active": True, "is_frozen": False}]
+    client.tables["users"] = [{"id": "user-admin", "telegram_id": ADMIN_TG, "team_id": TEAM, "name": "Admin",
+                               "role": "manager", "is_admin": True, "is_owner": True, "is_active": True}]
+    client.tables["users"] += [{"id": f"user-{i}", "telegram_id": 1000 + i, "team_id": TEAM, "name": f"User {i:03d}",
+                                "role": "employee", "is_admin": False, "is_owner": False, "is_active": True}
+                               for i in range(users)]
+    client.tables["limits"] = [{"id": f"limit-{d}-{s}", "team_id": TEAM, "date": d["date_iso"], "slot": s,
+                                "role": "employee", "max_count": LIMIT_PER_SLOT}
+                               for d in app.get_week_dates(*WEEK) for s in app.STD_SLOTS]
+    client.tables["shifts"] = []
+
+
+# --- апдейты ---
+def _user(tg: int) -> dict:
+    return {"id": tg, "is_bot": False, "first_name": f"u{tg}"}
+
+
+def message(tg: int, text: str) -> Update:
+    return Update.model_validate({"update_id": next(_update_ids), "message": {
+        "message_id": next(_update_ids), "date": datetime.now(), "chat": {"id": tg, "type": "private"},
+        "from": _user(tg), "text": text}})
+
+
+def callback(tg: int, data: str) -> Update:
+    return Update.model_validate({"update_id": next(_update_ids), "callback_query": {
+        "id": str(next(_update_ids)), "from": _user(tg), "chat_instance": "bench", "data": data,
+        "message": {"message_id": next(_update_ids), "date": datetime.now(),
+                    "chat": {"id": tg, "type": "private"}, "text": "…"}}})
+
+
+# --- сценарии: список сессий; апдейты одной сессии идут по очереди, сессии — параллельно ---
+def scenario_schedule(users: int) -> list:
+    return [[message(1000 + i, "📅 Расписание")] for i in range(users)]
+
+
+def scenario_booking(users: int) -> list:
+    # все в один (день, слот) — book_shift должен отказать всем сверх лимита
+    day = app.get_week_dates(*WEEK)[0]
+    slot = app.STD_SLOTS[0]
+    return [[message(1000 + i, "📝 Моя смена"),
+             message(1000 + i, f"{day['weekday']} {day['date']}"),
+             message(1000 + i, slot)]
+            for i in range(users)]
+
+
+def scenario_admin(users: int) -> list:
+    days = app.get_week_dates(*WEEK)
+    edits = [callback(ADMIN_TG, f"shift_slot:user-{i}:{days[i % len(days)]['date_iso']}:"
+                                f"{app.STD_SLOTS[(i + 1) % len(app.STD_SLOTS)]}")
+             for i in range(users)]
+    return [edits]   # один админ — правки строго по очереди
+
+
+SCENARIOS = {"schedule": scenario_schedule, "booking": scenario_booking, "admin": scenario_admin}
+
+
+def pct(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+async def run(name: str, users: int, concurrency: int, db_latency: float, tg_latency: float):
+    client = FakeSupabase(latency=db_latency)
+    seed(client, users)
+    app.db.client = client
+    for cache in (app.db.users, app.db.teams, app.db.weeks, app.db._tg_by_id):
+        cache.clear()
+    app.schedule_cache.invalidate(TEAM)
+    app.occupancy.invalidate(TEAM)
+
+    session = FakeSession(latency=tg_latency)
+    bot = Bot(token=os.environ["TELEGRAM_TOKEN"], session=session)
+    app.send_queue.bot = bot
+    sessions = SCENARIOS[name](users)
+    latencies = []
+    gate = asyncio.Semaphore(concurrency)
+    refused = []
+
+    def count_refusals(table, op, query, rows, seconds, error=None):
+        if op == "rpc" and isinstance(rows, dict) and rows.get("reason") == "limit":
+            refused.append(rows)
+
+    app.db.observers.append(count_refusals)
+
+    async def play(updates):
+        async with gate:
+            for upd in updates:
+                t0 = time.perf_counter()
+                await app.dp.feed_update(bot, upd)
+                latencies.append(time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    try:
+        await asyncio.gather(*(play(s) for s in sessions))
+    finally:
+        app.db.observers.remove(count_refusals)
+    elapsed = time.perf_counter() - t0
+    # уведомления (дайджесты) уходят после окна — в замер задержек не входят
+    app.notifier.flush_all()
+    await app.send_queue.close()
+
+    n = len(latencies)
+    print(f"{name:9s} updates={n:5d}  {n / elapsed:7.1f} upd/s  "
+          f"p50={pct(latencies, .5) * 1000:7.1f} ms  p95={pct(latencies, .95) * 1000:7.1f} ms  "
+          f"p99={pct(latencies, .99) * 1000:7.1f} ms  db_calls={client.calls}  "
+          f"tg_calls={sum(session.calls.values())}  uploaded={session.uploaded // 1024} KiB")
+    if name == "booking":
+        booked = [s for s in client.tables["shifts"] if s["slot"] in app.STD_SLOTS]
+        print(f"{'':9s} booked={len(booked)} refused={len(refused)} (limit {LIMIT_PER_SLOT})")
+        assert refused, "ни одного отказа по лимиту — сценарий без конкуренции"
+        assert len(booked) == LIMIT_PER_SLOT, f"забронировано {len(booked)} при лимите {LIMIT_PER_SLOT}"
+        assert len(booked) + len(refused) == users, "часть бронирований потерялась"
+
+
+async def main_async(args):
+    await app.renderer.warm_up()    # запуск воркеров — не в замере
+    try:
+        for name in (SCENARIOS if args.scenario == "all" else [args.scenario]):
+            await run(name, args.users, args.concurrency, args.db_latency, args.tg_latency)
+    finally:
+        app.renderer.shutdown()
+        app.db.close()
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--scenario", choices=["all", *SCENARIOS], default="all")
+    p.add_argument("--users", type=int, default=100)
+    p.add_argument("--concurrency", type=int, default=20)
+    p.add_argument("--db-latency", type=float, default=0.01)
+    p.add_argument("--tg-latency", type=float, default=0.03)
+    args = p.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
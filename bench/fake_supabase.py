@@ -0,0 +1,337 @@
+import re
+import threading
+import time
+from types import SimpleNamespace
+from uuid import uuid4
+
+
+# ---------------- FAKE SUPABASE ----------------
+# Таблицы в памяти + подмножество postgrest-цепочек, которые использует бот.
+# latency — искусственная задержка execute() (эмулирует сетевой round-trip,
+# блокирующий поток так же, как синхронный httpx).
+class FakeResponse:
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+
+class FakeQuery:
+    def __init__(self, db: "FakeSupabase", table: str):
+        self._db = db
+        self._table = table
+        self._op = "select"
+        self._columns = None
+        self._payload = None
+        self._on_conflict = None
+        self._filters = []
+        self._order = []
+        self._limit = None
+        self._count = None
+        self._head = False
+
+    # --- операции ---
+    def select(self, *columns, count=None, head=None):
+        self._op = "select"
+        self._columns = _parse_columns(columns)
+        self._count = count
+        self._head = bool(head)
+        return self
+
+    def insert(self, json, **kwargs):
+        self._op = "insert"
+        self._payload = json
+        return self
+
+    def upsert(self, json, on_conflict: str = "", **kwargs):
+        self._op = "upsert"
+        self._payload = json
+        self._on_conflict = [c.strip() for c in on_conflict.split(",") if c.strip()]
+        return self
+
+    def update(self, json, **kwargs):
+        self._op = "update"
+        self._payload = json
+        return self
+
+    def delete(self, **kwargs):
+        self._op = "delete"
+        return self
+
+    # --- фильтры ---
+    def _f(self, op, col, value):
+        self._filters.append((op, col, value))
+        return self
+
+    def eq(self, col, value): return self._f("eq", col, value)
+    def neq(self, col, value): return self._f("neq", col, value)
+    def gt(self, col, value): return self._f("gt", col, value)
+    def gte(self, col, value): return self._f("gte", col, value)
+    def lt(self, col, value): return self._f("lt", col, value)
+    def lte(self, col, value): return self._f("lte", col, value)
+    def is_(self, col, value): return self._f("is", col, value)
+    def in_(self, col, values): return self._f("in", col, list(values))
+    def ilike(self, col, pattern): return self._f("ilike", col, pattern)
+    def or_(self, filters: str): return self._f("or", None, _parse_logic(filters))
+
+    def order(self, col, desc: bool = False):
+        self._order.append((col, desc))
+        return self
+
+    def limit(self, n: int):
+        self._limit = n
+        return self
+
+    # --- описание запроса (как request.params у postgrest) ---
+    @property
+    def request(self):
+        params = []
+        if self._columns:
+            params.append(("select", ",".join(self._columns)))
+        if self._on_conflict:
+            params.append(("on_conflict", ",".join(self._on_conflict)))
+        for op, col, value in self._filters:
+            if op == "in":
+                value = "(" + ",".join(map(str, value)) + ")"
+            if op == "or":
+                params.append(("or", f"({value.source})"))
+                continue
+            params.append((col, f"{op}.{value}"))
+        if self._order:
+            params.append(("order", ",".join(f"{c}.{'desc' if d else 'asc'}" for c, d in self._order)))
+        if self._limit is not None:
+            params.append(("limit", str(self._limit)))
+        return SimpleNamespace(params=params, json=self._payload, path=f"/rest/v1/{self._table}")
+
+    # --- исполнение ---
+    def _match(self, row: dict) -> bool:
+        return all(_test(row, op, col, value) for op, col, value in self._filters)
+
+    def _project(self, row: dict) -> dict:
+        if not self._columns:
+            return dict(row)
+        return {c: row.get(c) for c in self._columns}
+
+    def execute(self) -> FakeResponse:
+        self._db.calls += 1
+        if self._db.latency:
+            time.sleep(self._db.latency)
+        with self._db.lock:
+            rows = self._db.tables.setdefault(self._table, [])
+            if self._op == "select":
+                out = [r for r in rows if self._match(r)]
+                for col, desc in reversed(self._order):
+                    out.sort(key=lambda r: (r.get(col) is None, r.get(col) or ""), reverse=desc)
+                total = len(out) if self._count else None
+                if self._limit is not None:
+                    out = out[:self._limit]
+                return FakeResponse([] if self._head else [self._project(r) for r in out], total)
+            if self._op == "insert":
+                payload = self._payload if isinstance(self._payload, list) else [self._payload]
+                out = []
+                for p in payload:
+                    row = {"id": str(uuid4()), **p}
+                    rows.append(row)
+                    out.append(dict(row))
+                return FakeResponse(out)
+            if self._op == "upsert":
+                payload = self._payload if isinstance(self._payload, list) else [self._payload]
+                out = []
+                for p in payload:
+                    row = next((r for r in rows if all(r.get(k) == p.get(k) for k in self._on_conflict)), None)
+                    if row is None:
+                        row = {"id": str(uuid4()), **p}
+                        rows.append(row)
+                    else:
+                        row.update(p)
+                    out.append(dict(row))
+                return FakeResponse(out)
+            if self._op == "update":
+                out = []
+                for r in rows:
+                    if self._match(r):
+                        r.update(self._payload)
+                        out.append(dict(r))
+                return FakeResponse(out)
+            if self._op == "delete":
+                keep, out = [], []
+                for r in rows:
+                    (out if self._match(r) else keep).append(r)
+                rows[:] = keep
+                return FakeResponse([dict(r) for r in out])
+        raise ValueError(f"unsupported op {self._op}")
+
+
+def _test(row: dict, op: str, col, value) -> bool:
+    if op == "or":
+        return value.test(row)
+    v = row.get(col)
+    if op == "eq": return v == value
+    if op == "neq": return v != value
+    if op == "is": return v is value
+    if op == "in": return v in value
+    if op == "ilike":
+        return v is not None and _like_regex(value).fullmatch(str(v)) is not None
+    if v is None:
+        return False
+    if op == "gt": return v > value
+    if op == "gte": return v >= value
+    if op == "lt": return v < value
+    if op == "lte": return v <= value
+    raise ValueError(f"unsupported filter {op}")
+
+
+def _like_regex(pattern: str):
+    # % и * — любая строка, _ — один символ, \ — экранирование
+    out, i = [], 0
+    while i < len(pattern):
+        ch = pattern[i]
+        if ch == "\\" and i + 1 < len(pattern):
+            out.append(re.escape(pattern[i + 1]))
+            i += 2
+            continue
+        out.append(".*" if ch in "%*" else "." if ch == "_" else re.escape(ch))
+        i += 1
+    return re.compile("".join(out), re.IGNORECASE | re.DOTALL)
+
+
+# Логические фильтры postgrest: "a.gt.1,and(b.eq.\"x, y\",c.lt.2)"
+class _Logic:
+    def __init__(self, kind: str, items: list, source: str = ""):
+        self.kind = kind        # "or" | "and"
+        self.items = items      # _Logic или (op, col, value)
+        self.source = source
+
+    def test(self, row: dict) -> bool:
+        results = (i.test(row) if isinstance(i, _Logic) else _test(row, *i) for i in self.items)
+        return any(results) if self.kind == "or" else all(results)
+
+
+def _split_top(text: str) -> list:
+    parts, depth, quoted, cur, i = [], 0, False, [], 0
+    while i < len(text):
+        ch = text[i]
+        if quoted and ch == "\\":
+            cur.append(text[i:i + 2])
+            i += 2
+            continue
+        if ch == '"':
+            quoted = not quoted
+        elif not quoted and ch == "(":
+            depth += 1
+        elif not quoted and ch == ")":
+            depth -= 1
+        elif not quoted and depth == 0 and ch == ",":
+            parts.append("".join(cur))
+            cur = []
+            i += 1
+            continue
+        cur.append(ch)
+        i += 1
+    parts.append("".join(cur))
+    return parts
+
+
+def _parse_value(raw: str):
+    if len(raw) >= 2 and raw[0] == raw[-1] == '"':
+        return re.sub(r"\\(.)", r"\1", raw[1:-1])
+    return raw
+
+
+def _parse_logic(text: str, kind: str = "or") -> _Logic:
+    items = []
+    for part in _split_top(text):
+        m = re.fullmatch(r"(and|or)\((.*)\)", part, re.DOTALL)
+        if m:
+            items.append(_parse_logic(m.group(2), m.group(1)))
+            continue
+        col, op, raw = part.split(".", 2)
+        if op == "in":
+            items.append((op, col, [_parse_value(v) for v in _split_top(raw[1:-1])]))
+            continue
+        items.append((op, col, _parse_value(raw)))
+    return _Logic(kind, items, text)
+
+
+def _parse_columns(columns) -> list:
+    cols = []
+    for c in columns:
+        cols.extend(x.strip() for x in c.split(","))
+    cols = [c for c in cols if c]
+    return [] if cols == ["*"] else cols
+
+
+NO_SHIFT = {"-", "вых", "выходной"}
+
+
+# Повторяет sql/004_book_shift_week_check.sql; вызывается под общим локом заглушки,
+# как функция в БД — под advisory lock.
+def book_shift(db: "FakeSupabase", p: dict) -> dict:
+    shifts = db.tables.setdefault("shifts", [])
+    users = {u["id"]: u for u in db.tables.get("users", [])}
+    team_id, user_id, date, slot = p["p_team_id"], p["p_user_id"], p["p_date"], p["p_slot"]
+    role, max_count, daily, taken = None, None, False, 0
+    week = next((w for w in db.tables.get("weeks", []) if w["team_id"] == team_id and w.get("is_active")
+                 and w["start_date"] <= date <= w["end_date"]), None)
+    if week is None:
+        return {"ok": False, "reason": "week"}
+    user = users.get(user_id, {})
+    if week.get("is_frozen") and not (user.get("is_admin") or user.get("is_owner")):
+        return {"ok": False, "reason": "frozen"}
+    if slot not in NO_SHIFT:
+        role = users.get(user_id, {}).get("role")
+        limits = [r for r in db.tables.get("limits", [])
+                  if r["team_id"] == team_id and r["date"] == date and r["role"] == role and role is not None]
+        max_count = next((r["max_count"] for r in limits if r["slot"] == slot), None)
+        if max_count is None:
+            max_count = next((r["max_count"] for r in limits if r["slot"] is None), None)
+            daily = max_count is not None
+        if max_count is not None:
+            for s in shifts:
+                u = users.get(s["user_id"], {})
+                if s["team_id"] != team_id or s["date"] != date or s["user_id"] == user_id:
+                    continue
+                if u.get("role") != role or not u.get("is_active", True):
+                    continue
+                if (daily and (s["slot"] or "").strip() not in NO_SHIFT) or (not daily and s["slot"] == slot):
+                    taken += 1
+            if taken >= max_count:
+                return {"ok": False, "reason": "limit", "role": role, "taken": taken, "max_count": max_count, "daily": daily}
+    row = next((s for s in shifts if s["team_id"] == team_id and s["user_id"] == user_id and s["date"] == date), None)
+    if row is None:
+        shifts.append({"id": str(uuid4()), "team_id": team_id, "user_id": user_id, "date": date, "slot": slot})
+    else:
+        row["slot"] = slot
+    return {"ok": True, "role": role, "taken": taken, "max_count": max_count, "daily": daily}
+
+
+class FakeRpc:
+    def __init__(self, db: "FakeSupabase", name: str, params: dict):
+        self._db = db
+        self._name = name
+        self._params = params
+
+    @property
+    def request(self):
+        return SimpleNamespace(params=[], json=self._params, path=f"/rest/v1/rpc/{self._name}")
+
+    def execute(self) -> FakeResponse:
+        self._db.calls += 1
+        if self._db.latency:
+            time.sleep(self._db.latency)
+        with self._db.lock:
+            return FakeResponse(self._db.functions[self._name](self._db, self._params))
+
+
+class FakeSupabase:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.tables = {}
+        self.functions = {"book_shift": book_shift}
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def table(self, name: str) -> FakeQuery:
+        return FakeQuery(self, name)
+
+    def rpc(self, name: str, params: dict) -> FakeRpc:
+        return FakeRpc(self, name, params)
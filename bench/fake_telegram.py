@@ -0,0 +1,56 @@
+import asyncio
+import os
+from collections import Counter
+from datetime import datetime
+from typing import get_args
+
+from aiogram.client.session.base import BaseSession
+from aiogram.types import BufferedInputFile, Chat, FSInputFile, Message, PhotoSize
+
+
+# ---------------- FAKE TELEGRAM ----------------
+# Сессия бота без сети: каждый вызов Bot API «успешен» через latency секунд.
+# Методы, возвращающие Message, получают правдоподобное сообщение (с photo и
+# file_id для sendPhoto), остальные — True. calls — счётчик по методам,
+# uploaded — байты загруженных файлов.
+class FakeSession(BaseSession):
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+        self.calls = Counter()
+        self.uploaded = 0
+        self._message_id = 0
+
+    async def make_request(self, bot, method, timeout=None):
+        name = method.__api_method__
+        self.calls[name] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        returning = method.__returning__
+        if returning is Message or Message in get_args(returning):
+            return self._message(bot, method)
+        return True
+
+    def _message(self, bot, method) -> Message:
+        self._message_id += 1
+        chat_id = getattr(method, "chat_id", None) or 0
+        photo = None
+        file = getattr(method, "photo", None)
+        if file is not None:
+            if isinstance(file, FSInputFile):
+                self.uploaded += os.path.getsize(file.path)
+            elif isinstance(file, BufferedInputFile):
+                self.uploaded += len(file.data)
+            file_id = file if isinstance(file, str) else f"file-{self._message_id}"
+            photo = [PhotoSize(file_id=file_id, file_unique_id=file_id, width=1280, height=720)]
+        return Message(
+            message_id=self._message_id, date=datetime.now(),
+            chat=Chat(id=chat_id, type="private"),
+            text=getattr(method, "text", None), photo=photo,
+        ).as_(bot)
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def close(self):
+        pass
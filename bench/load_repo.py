@@ -0,0 +1,86 @@
+"""Нагрузочный тест слоя данных: синхронные вызовы в корутине против Repo.
+
+before/after сравнивают только вынос запросов в пул потоков: в after кэши Repo
+(пользователи, команды, недели) выключены. Прогон с кэшами — отдельной строкой.
+
+Запуск из корня репозитория:
+    python -m bench.load_repo --updates 200 --latency 0.02
+"""
+import argparse
+import asyncio
+import time
+
+from bench.fake_supabase import FakeSupabase
+from repo import Repo
+
+
+def seed(client: FakeSupabase, teams: int, users_per_team: int):
+    for t in range(teams):
+        team_id = f"team-{t}"
+        client.tables.setdefault("weeks", []).append({
+            "id": f"week-{t}", "team_id": team_id, "start_date": "2025-08-18",
+            "end_date": "2025-08-24", "is_active": True, "is_frozen": False,
+        })
+        for u in range(users_per_team):
+            client.tables.setdefault("users", []).append({
+                "id": f"user-{t}-{u}", "telegram_id": t * 1000 + u, "team_id": team_id,
+                "name": f"User {u}", "role": "employee", "is_active": True,
+            })
+
+
+# Запросы, которые делает просмотр расписания, — как было: execute() прямо в корутине
+async def schedule_view_sync(client, telegram_id: int):
+    user = client.table("users").select("*").eq("telegram_id", telegram_id).execute().data[0]
+    client.table("weeks").select("*").eq("team_id", user["team_id"]).eq("is_active", True).execute()
+    client.table("users").select("id,name,role,is_active").eq("team_id", user["team_id"]).execute()
+    client.table("shifts").select("*").eq("team_id", user["team_id"]).execute()
+
+
+# То же самое через Repo (пул потоков)
+async def schedule_view_repo(db: Repo, telegram_id: int):
+    user = await db.get_user_by_tg(telegram_id)
+    week = await db.get_active_week(user["team_id"])
+    await db.list_team_users(user["team_id"], "id,name,role,is_active")
+    await db.list_shifts(user["team_id"], week["start_date"], week["end_date"])
+
+
+async def run(args):
+    client = FakeSupabase(latency=args.latency)
+    seed(client, args.teams, args.users)
+    tg_ids = [(i % args.teams) * 1000 + (i % args.users) for i in range(args.updates)]
+
+    t0 = time.perf_counter()
+    calls = client.calls
+    await asyncio.gather(*(schedule_view_sync(client, tg) for tg in tg_ids))
+    before, before_calls = args.updates / (time.perf_counter() - t0), client.calls - calls
+
+    async def via_repo(cache_size: int):
+        db = Repo(client, workers=args.workers, cache_size=cache_size)
+        t0, calls = time.perf_counter(), client.calls
+        try:
+            await asyncio.gather(*(schedule_view_repo(db, tg) for tg in tg_ids))
+        finally:
+            db.close()
+        return args.updates / (time.perf_counter() - t0), client.calls - calls
+
+    after, after_calls = await via_repo(cache_size=0)     # cache_size=0 — кэши Repo ничего не хранят
+    cached, cached_calls = await via_repo(cache_size=10000)
+
+    print(f"updates={args.updates} teams={args.teams} latency={args.latency * 1000:.0f}ms workers={args.workers}")
+    print(f"before (sync in loop):   {before:8.1f} updates/sec  db_calls={before_calls}")
+    print(f"after  (Repo, no cache): {after:8.1f} updates/sec  db_calls={after_calls}  (x{after / before:.1f})")
+    print(f"Repo + caches:           {cached:8.1f} updates/sec  db_calls={cached_calls}  (x{cached / before:.1f})")
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--updates", type=int, default=200)
+    p.add_argument("--teams", type=int, default=20)
+    p.add_argument("--users", type=int, default=30)
+    p.add_argument("--latency", type=float, default=0.02)
+    p.add_argument("--workers", type=int, default=8)
+    asyncio.run(run(p.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
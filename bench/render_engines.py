@@ -0,0 +1,64 @@
+"""Сравнение движков рендера расписания: matplotlib (ax.table) и Pillow.
+
+Рендер идёт в текущем процессе, без пула; время — медиана из --repeat запусков.
+
+Запуск из корня репозитория:
+    python -m bench.render_engines --staff 20 50 100 200 --repeat 3
+    python -m bench.render_engines --format webp --dpi 120 --quality 80
+"""
+import argparse
+import random
+import statistics
+import time
+from datetime import date, timedelta
+
+from render import IMAGE_FORMATS, RENDER_ENGINES, ROLE_MAP
+
+WEEK_START = date(2025, 8, 18)
+WEEKDAYS = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"]
+SLOTS = ["09:30-23:00", "10:00-23:00", "11:00-23:00", "12:00-23:00", "13:00-23:00", "17:00-23:00", "вых", "-"]
+
+
+def make_data(staff: int, seed: int = 1):
+    rnd = random.Random(seed)
+    week_days = []
+    for i in range(7):
+        d = WEEK_START + timedelta(days=i)
+        week_days.append({"weekday": WEEKDAYS[i], "date": d.strftime("%d.%m"), "date_iso": d.isoformat()})
+    roles = list(ROLE_MAP) + [None]
+    users = [{"id": f"u{i}", "name": f"Сотрудник {i:03d}", "role": rnd.choice(roles), "is_active": True}
+             for i in range(staff)]
+    shifts = [{"user_id": u["id"], "date": d["date_iso"], "slot": rnd.choice(SLOTS)}
+              for u in users for d in week_days if rnd.random() < 0.8]
+    return users, week_days, shifts
+
+
+def measure(fn, users, week_days, shifts, repeat: int, **opts):
+    times, size = [], 0
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        size = len(fn(users, week_days, shifts, **opts))
+        times.append(time.perf_counter() - t0)
+    return statistics.median(times), size
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--staff", type=int, nargs="+", default=[20, 50, 100, 200])
+    p.add_argument("--repeat", type=int, default=3)
+    p.add_argument("--format", choices=list(IMAGE_FORMATS), default="png")
+    p.add_argument("--dpi", type=int, default=170)
+    p.add_argument("--quality", type=int, default=85)
+    args = p.parse_args()
+    opts = {"fmt": args.format, "dpi": args.dpi, "quality": args.quality}
+
+    for staff in args.staff:
+        data = make_data(staff)
+        results = {name: measure(fn, *data, args.repeat, **opts) for name, fn in RENDER_ENGINES.items()}
+        line = "  ".join(f"{name}={t * 1000:7.0f} ms ({size // 1024} KiB)" for name, (t, size) in results.items())
+        speedup = results["matplotlib"][0] / results["pillow"][0]
+        print(f"staff={staff:4d}  {line}  x{speedup:.1f}")
+
+
+if __name__ == "__main__":
+    main()
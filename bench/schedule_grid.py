@@ -0,0 +1,85 @@
+"""Микробенчмарк подготовки таблицы расписания (без matplotlib).
+
+legacy — прежний вложенный перебор shifts для каждой пары (сотрудник, день),
+index  — render.build_schedule_rows (индекс (user_id, date) + группировка за один проход).
+
+Запуск из корня репозитория:
+    python -m bench.schedule_grid --staff 200 --years 2
+"""
+import argparse
+import random
+import time
+from datetime import date, timedelta
+
+from render import ROLE_MAP, ROLES_ORDER, build_schedule_rows
+
+WEEK_START = date(2025, 8, 18)
+ROLES = list(ROLE_MAP) + [None]
+
+
+def legacy_rows(users, week_days, shifts):
+    users = [u for u in users if u.get("is_active", True)]
+    data_rows = []
+    for role in ROLES_ORDER:
+        if role == "other":
+            role_users = [u for u in users if not u.get('role') or u.get('role') not in ROLES_ORDER[:-1]]
+            if not role_users:
+                continue
+            data_rows.append(["Другие"] + [""] * len(week_days))
+        else:
+            role_users = [u for u in users if u.get('role') == role]
+            if not role_users:
+                continue
+            data_rows.append([ROLE_MAP[role]] + [""] * len(week_days))
+        for u in role_users:
+            row = [u["name"]]
+            for day in week_days:
+                slot = next((s["slot"] for s in shifts if s["user_id"] == u["id"] and s["date"] == day["date_iso"]), "-")
+                row.append(slot)
+            data_rows.append(row)
+    return data_rows
+
+
+def make_data(staff: int, years: int):
+    rnd = random.Random(1)
+    users = [{"id": f"user-{i}", "name": f"User {i:03d}", "role": rnd.choice(ROLES), "is_active": rnd.random() > 0.05}
+             for i in range(staff)]
+    first = WEEK_START - timedelta(days=365 * years)
+    shifts = []
+    for d in range((WEEK_START + timedelta(days=7) - first).days):
+        day = (first + timedelta(days=d)).isoformat()
+        for u in users:
+            if rnd.random() < 0.7:
+                shifts.append({"user_id": u["id"], "date": day, "slot": "10:00-23:00"})
+    week_days = [{"weekday": "Пн Вт Ср Чт Пт Сб Вс".split()[i],
+                  "date": (WEEK_START + timedelta(days=i)).strftime("%d.%m"),
+                  "date_iso": (WEEK_START + timedelta(days=i)).isoformat()} for i in range(7)]
+    return users, week_days, shifts
+
+
+def timeit(fn, repeat: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - t0) / repeat * 1000
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--staff", type=int, default=200)
+    p.add_argument("--years", type=int, default=2)
+    p.add_argument("--repeat", type=int, default=1)
+    args = p.parse_args()
+
+    users, week_days, shifts = make_data(args.staff, args.years)
+    assert legacy_rows(users, week_days, shifts) == build_schedule_rows(users, week_days, shifts)[1]
+
+    legacy = timeit(lambda: legacy_rows(users, week_days, shifts), args.repeat)
+    index = timeit(lambda: build_schedule_rows(users, week_days, shifts), args.repeat)
+    print(f"staff={args.staff} shifts={len(shifts)} days={len(week_days)}")
+    print(f"legacy: {legacy:10.1f} ms")
+    print(f"index:  {index:10.2f} ms  (x{legacy / index:.0f})")
+
+
+if __name__ == "__main__":
+    main()
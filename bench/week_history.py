@@ -0,0 +1,66 @@
+"""Стоимость загрузки смен для расписания в зависимости от длины истории команды.
+
+Сравнивает ответ старого запроса (select * по team_id — вся история) с ответом
+запроса недели (user_id,date,slot в диапазоне дат). Для каждого варианта
+меряется то, что платит бот: размер ответа и разбор JSON + подготовка ключа кэша.
+
+Запуск из корня репозитория:
+    python -m bench.week_history --staff 50
+"""
+import argparse
+import json
+import time
+from datetime import date, timedelta
+from uuid import uuid4
+
+from cache import ScheduleCache
+
+WEEK_START = date(2025, 8, 18)
+
+
+def make_history(staff: int, years: int) -> list:
+    rows = []
+    first = WEEK_START - timedelta(days=365 * years)
+    for d in range((WEEK_START + timedelta(days=7) - first).days):
+        day = (first + timedelta(days=d)).isoformat()
+        for u in range(staff):
+            rows.append({
+                "id": str(uuid4()), "team_id": "team-1", "user_id": f"user-{u}",
+                "date": day, "slot": "10:00-23:00", "created_at": day + "T08:00:00Z",
+            })
+    return rows
+
+
+def measure(payload: bytes, week: dict, users: list, repeat: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        shifts = json.loads(payload)
+        ScheduleCache.make_key("team-1", week, users, shifts)
+    return (time.perf_counter() - t0) / repeat * 1000
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--staff", type=int, default=50)
+    p.add_argument("--years", type=int, nargs="+", default=[1, 2, 4, 8])
+    p.add_argument("--repeat", type=int, default=5)
+    args = p.parse_args()
+
+    start, end = WEEK_START.isoformat(), (WEEK_START + timedelta(days=6)).isoformat()
+    week = {"id": "week-1", "start_date": start, "end_date": end}
+    users = [{"id": f"user-{u}", "name": f"User {u}", "role": "employee"} for u in range(args.staff)]
+
+    print(f"staff={args.staff}")
+    print(f"{'years':>5} {'all rows':>10} {'all KB':>9} {'all ms':>8} | {'week rows':>9} {'week KB':>8} {'week ms':>8}")
+    for years in args.years:
+        history = make_history(args.staff, years)
+        full = json.dumps(history).encode()
+        week_rows = [{"user_id": r["user_id"], "date": r["date"], "slot": r["slot"]}
+                     for r in history if start <= r["date"] <= end]
+        scoped = json.dumps(week_rows).encode()
+        print(f"{years:>5} {len(history):>10} {len(full) / 1024:>9.0f} {measure(full, week, users, args.repeat):>8.1f} | "
+              f"{len(week_rows):>9} {len(scoped) / 1024:>8.1f} {measure(scoped, week, users, args.repeat):>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
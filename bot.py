@@ -1,40 +1,164 @@
+import asyncio
+import logging
 import os
 import time
 from datetime import datetime, timedelta
+from functools import lru_cache
 from uuid import uuid4
 
-import matplotlib.pyplot as plt
 from aiogram import Bot, Dispatcher, types, F
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.types import (
     ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove,
-    FSInputFile, CallbackQuery,
+    BufferedInputFile, CallbackQuery, InlineKeyboardButton,
 )
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from dotenv import load_dotenv
 from supabase import create_client, Client
 
+from autofill import auto_fill
+from cache import ScheduleCache
+from metrics import HandlerMetrics, Metrics, TelegramMetrics, start_server
+from middlewares import ConcurrencyLimit, TeamLocks
+from notify import Notifier, SendQueue, fan_out
+from occupancy import NO_SHIFT, Occupancy
+from render import IMAGE_FORMATS, RENDER_ENGINES, RenderService, RenderQueueFull
+from repo import Repo
+from storage import make_fsm_storage
+from tracing import TraceHandler, TraceUpdate, on_query as trace_query
+
 
 # ---------------- ENV & INIT ----------------
 load_dotenv()
+log = logging.getLogger("bot")
 
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+DB_WORKERS = int(os.getenv("DB_WORKERS", "8"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "300"))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+OCCUPANCY_TTL = float(os.getenv("OCCUPANCY_TTL", "60"))
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", "2"))
+RENDER_QUEUE = int(os.getenv("RENDER_QUEUE", "16"))
+SCHEDULE_ENGINE = os.getenv("SCHEDULE_ENGINE", "pillow").lower()   # pillow | matplotlib
+SCHEDULE_FORMAT = os.getenv("SCHEDULE_FORMAT", "png").lower()      # png | webp | jpeg
+SCHEDULE_DPI = int(os.getenv("SCHEDULE_DPI", "170"))
+SCHEDULE_QUALITY = int(os.getenv("SCHEDULE_QUALITY", "85"))         # для webp/jpeg
+FSM_STORAGE = os.getenv("FSM_STORAGE", "memory")
+FSM_TTL = float(os.getenv("FSM_TTL", "86400"))
+FSM_SQLITE_PATH = os.getenv("FSM_SQLITE_PATH", "fsm.sqlite3")
+REDIS_URL = os.getenv("REDIS_URL")
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "64"))
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()   # polling | webhook
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))   # 0 — эндпоинт /metrics выключен
+DB_TRACE = os.getenv("DB_TRACE", "0").lower() in ("1", "true", "yes")
+NOTIFY_WINDOW = float(os.getenv("NOTIFY_WINDOW", "10"))
+SEND_RATE = float(os.getenv("SEND_RATE", "25"))
+SEND_CHAT_INTERVAL = float(os.getenv("SEND_CHAT_INTERVAL", "1.0"))
+AUTOFILL_MAX_DAYS = int(os.getenv("AUTOFILL_MAX_DAYS", "5"))
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN") or os.getenv("BOT_TOKEN")
 
 if not TELEGRAM_TOKEN:
     print("ERROR: TELEGRAM_TOKEN (или BOT_TOKEN) не найден в .env")
     raise SystemExit(1)
-print("TOKEN OK: ****" + TELEGRAM_TOKEN[-6:])
+
+if SCHEDULE_ENGINE not in RENDER_ENGINES:
+    print(f"ERROR: SCHEDULE_ENGINE={SCHEDULE_ENGINE!r}, допустимо: {', '.join(RENDER_ENGINES)}")
+    raise SystemExit(1)
+if SCHEDULE_FORMAT not in IMAGE_FORMATS:
+    print(f"ERROR: SCHEDULE_FORMAT={SCHEDULE_FORMAT!r}, допустимо: {', '.join(IMAGE_FORMATS)}")
+    raise SystemExit(1)
+make_schedule_image = RENDER_ENGINES[SCHEDULE_ENGINE]
 
 if not SUPABASE_URL or not SUPABASE_KEY:
     print("WARN: SUPABASE_URL/SUPABASE_KEY не заданы — проверь .env")
 
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+db = Repo(supabase, workers=DB_WORKERS, cache_ttl=USER_CACHE_TTL, cache_size=USER_CACHE_SIZE)
+renderer = RenderService(workers=RENDER_WORKERS, queue_size=RENDER_QUEUE)
+renderer.start()   # до первых потоков (пулы БД и FSM) — см. render.py
+schedule_cache = ScheduleCache()
+occupancy = Occupancy(db, ttl=OCCUPANCY_TTL)
+db.listeners.append(schedule_cache.on_change)
+db.listeners.append(occupancy.on_change)
 bot = Bot(token=TELEGRAM_TOKEN)
-dp = Dispatcher()
+fsm_storage, events_isolation = make_fsm_storage(FSM_STORAGE, FSM_TTL, FSM_SQLITE_PATH, REDIS_URL)
+dp = Dispatcher(storage=fsm_storage, events_isolation=events_isolation)
+limiter = ConcurrencyLimit(MAX_CONCURRENT_UPDATES)
+dp.update.outer_middleware(limiter)
+
+
+# Изменения данных одной команды (flags=TEAM_LOCK) выполняются по очереди,
+# разные команды — параллельно
+async def _team_of(event) -> str | None:
+    u = await db.get_user_by_tg(event.from_user.id)
+    return u.get("team_id") if u else None
+
+
+TEAM_LOCK = {"team_lock": True}
+team_locks = TeamLocks(_team_of)
+dp.message.middleware(team_locks)
+dp.callback_query.middleware(team_locks)
+
+# ---------------- METRICS ----------------
+metrics = Metrics()
+db.observers.append(metrics.on_query)
+bot.session.middleware(TelegramMetrics(metrics))
+dp.message.middleware(HandlerMetrics(metrics))
+dp.callback_query.middleware(HandlerMetrics(metrics))
+metrics.gauge("bot_updates_in_flight", "Апдейты в обработке и в очереди", lambda: limiter.pending)
+metrics.gauge("bot_render_pending", "Рендеры расписания в работе и в очереди", lambda: renderer.pending)
+metrics.gauge("bot_team_locks_active", "Команды с занятым или ожидаемым локом", lambda: team_locks.active)
+metrics_runner = None
+
+# ---------------- NOTIFICATIONS ----------------
+# Исходящие рассылки идут через общую очередь с лимитами Telegram; уведомления
+# об изменениях копятся по получателю NOTIFY_WINDOW секунд и уходят дайджестом.
+send_queue = SendQueue(bot, rate=SEND_RATE, chat_interval=SEND_CHAT_INTERVAL)
+notifier = Notifier(send_queue, window=NOTIFY_WINDOW)
+metrics.gauge("bot_send_queue", "Сообщения в очереди рассылки", lambda: len(send_queue))
+
+
+@dp.shutdown()
+async def _stop_notifications():
+    notifier.flush_all()
+    await send_queue.close()
+
+
+# ---------------- DB TRACE ----------------
+# DB_TRACE=1: одна строка лога db_trace на апдейт со всеми запросами к БД
+if DB_TRACE:
+    db.observers.append(trace_query)
+    dp.update.outer_middleware(TraceUpdate())
+    dp.message.middleware(TraceHandler())
+    dp.callback_query.middleware(TraceHandler())
+
+
+@dp.startup()
+async def _start_renderer():
+    await renderer.warm_up()
+
+
+@dp.startup()
+async def _start_metrics():
+    global metrics_runner
+    if METRICS_PORT:
+        metrics_runner = await start_server(metrics, METRICS_HOST, METRICS_PORT)
+
+
+@dp.shutdown()
+async def _stop_metrics():
+    if metrics_runner is not None:
+        await metrics_runner.cleanup()
 
 
 # ---------------- STATES ----------------
@@ -67,6 +191,7 @@ class AdminLimitsState(StatesGroup):
 # Админ-панель: участники
 class AdminMembersState(StatesGroup):
     browsing = State()
+    waiting_for_search = State()
     member_card = State()
     changing_role = State()
 
@@ -79,8 +204,12 @@ class AdminShiftsState(StatesGroup):
     choosing_slot = State()
 
 
+# Админ-панель: редактор недели (массовая правка смен одним сохранением)
+class AdminGridState(StatesGroup):
+    editing = State()
+
+
 # ---------------- CONSTS & HELPERS ----------------
-ROLE_HEADERS = {'Официанты', 'Бармен', 'Хостес', 'Ранеры', 'Админы', 'Стажёры', 'Другие'}
 ROLE_CODES = [
     ("Официанты", "employee"),
     ("Хостес",     "host"),
@@ -90,7 +219,6 @@ ROLE_CODES = [
     ("Стажёры",    "trainee"),
 ]
 STD_SLOTS = ["09:30-23:00", "10:00-23:00", "11:00-23:00", "12:00-23:00", "13:00-23:00", "17:00-23:00"]
-NO_SHIFT = {"-", "вых", "выходной"}  # значения, не считающиеся сменой
 PAGE_SIZE = 10
 
 
@@ -98,6 +226,23 @@ def ensure_admin(user_row: dict) -> bool:
     return bool(user_row and (user_row.get("is_admin") or user_row.get("is_owner")))
 
 
+def day_label(date_iso: str) -> str:
+    d = datetime.strptime(date_iso, "%Y-%m-%d")
+    return f"{['Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс'][d.weekday()]} {d:%d.%m}"
+
+
+async def notify_member(team_id: str, user_id: str, line: str, key=None, actor_tg: int = None):
+    u = await db.get_team_member(user_id, team_id)
+    if u and u.get("telegram_id") and u["telegram_id"] != actor_tg:
+        notifier.notify(u["telegram_id"], line, key=key)
+
+
+async def notify_team(team_id: str, line: str, key=None, actor_tg: int = None):
+    for u in await db.list_team_users(team_id, "telegram_id,is_active"):
+        if u.get("telegram_id") and u.get("is_active", True) and u["telegram_id"] != actor_tg:
+            notifier.notify(u["telegram_id"], line, key=key)
+
+
 def now_iso_z() -> str:
     # UTC ISO8601 с Z — нормально пишется в timestamptz
     return datetime.utcnow().isoformat() + "Z"
@@ -122,14 +267,8 @@ def start_keyboard():
 
 
 # ---------------- DATA HELPERS ----------------
-def get_active_week(team_id):
-    week_resp = supabase.table("weeks").select("*").eq("team_id", team_id).eq("is_active", True).execute()
-    if not week_resp.data:
-        return None
-    return week_resp.data[0]
-
-
-def get_week_dates(start_date, end_date):
+@lru_cache(maxsize=256)
+def _week_dates(start_date, end_date) -> tuple:
     wdays = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"]
     dates = []
     d0 = datetime.strptime(start_date, "%Y-%m-%d")
@@ -141,83 +280,20 @@ def get_week_dates(start_date, end_date):
             "date": cur.strftime("%d.%m"),
             "date_iso": cur.strftime("%Y-%m-%d"),
         })
-    return dates
-
-
-# ---------------- SCHEDULE RENDER ----------------
-def make_schedule_image(users, week_days, shifts, team_id: str):
-    # Показываем только активных (если поля нет — считаем активным)
-    users = [u for u in users if u.get("is_active", True)]
-
-    columns = ["ФИО"] + [f"{day['weekday']} {day['date']}" for day in week_days]
-    role_map = {
-        "employee": "Официанты",
-        "barman": "Бармен",
-        "host": "Хостес",
-        "runner": "Ранеры",
-        "admin": "Админы",
-        "trainee": "Стажёры",
-    }
-    roles_order = ["employee", "barman", "host", "runner", "admin", "trainee", "other"]
-    data_rows = []
-    header_rows = []
-
-    for role in roles_order:
-        if role == "other":
-            role_users = [u for u in users if not u.get('role') or u.get('role') not in roles_order[:-1]]
-            if not role_users:
-                continue
-            data_rows.append(["Другие"] + [""] * len(week_days))
-            header_rows.append(len(data_rows) - 1)
-        else:
-            role_users = [u for u in users if u.get('role') == role]
-            if not role_users:
-                continue
-            data_rows.append([role_map[role]] + [""] * len(week_days))
-            header_rows.append(len(data_rows) - 1)
-        for u in role_users:
-            row = [u["name"]]
-            for day in week_days:
-                slot = next((s["slot"] for s in shifts if s["user_id"] == u["id"] and s["date"] == day["date_iso"]), "-")
-                row.append(slot)
-            data_rows.append(row)
-
-    n_cols = len(columns)
-    n_rows = len(data_rows)
-    fig_w = min(max(2 + n_cols * 1.35, 8), 24)
-    fig_h = min(max(1.8 + n_rows * 0.7, 3), 28)
-    fig, ax = plt.subplots(figsize=(fig_w, fig_h))
-    ax.axis('off')
-    table = ax.table(cellText=data_rows, colLabels=columns, cellLoc='center', loc='center', bbox=[0, 0, 1, 1])
-    table.auto_set_font_size(False)
-    table.set_fontsize(13)
-    table.auto_set_column_width(col=list(range(n_cols)))
-
-    for (row, col), cell in table.get_celld().items():
-        if row == 0:
-            cell.set_fontsize(14)
-            cell.set_text_props(weight="bold")
-            cell.set_facecolor("#e3ebfa")
-        elif col == 0 and row > 0 and data_rows[row - 1][0] in ROLE_HEADERS:
-            cell.set_facecolor("#FFD580")
-            cell.set_text_props(weight="bold", color="black")
-        else:
-            cell.set_facecolor("white")
-            cell.set_text_props(weight="normal", color="black")
+    return tuple(dates)
 
-    plt.tight_layout()
-    out_path = f"schedule_{team_id}_{int(time.time())}.png"
-    plt.savefig(out_path, bbox_inches='tight', transparent=True, dpi=170)
-    plt.close(fig)
-    return out_path
+
+def get_week_dates(start_date, end_date):
+    # мемоизировано по (start, end); наружу отдаём копии, чтобы кэш не мутировали
+    return [dict(d) for d in _week_dates(start_date, end_date)]
 
 
 # ---------------- COMMANDS ----------------
 @dp.message(Command("start"))
 async def cmd_start(message: types.Message, state: FSMContext):
-    user = supabase.table("users").select("*").eq("telegram_id", message.from_user.id).execute().data
-    if not user:
-        supabase.table("users").insert({
+    u = await db.get_user_by_tg(message.from_user.id)
+    if not u:
+        await db.create_user({
             "telegram_id": message.from_user.id,
             "name": message.from_user.full_name or message.from_user.username or f"user_{message.from_user.id}",
             "team_id": None,
@@ -225,10 +301,9 @@ async def cmd_start(message: types.Message, state: FSMContext):
             "is_admin": False,
             "role": None,
             "is_active": True,
-        }).execute()
-        user = [{"team_id": None, "is_active": True}]
+        })
+        u = {"team_id": None, "is_active": True}
 
-    u = user[0]
     if u.get("team_id"):
         if not u.get("is_active", True):
             await message.answer("Твой профиль в команде отключён. Обратись к администратору.")
@@ -250,17 +325,17 @@ async def create_team_name(message: types.Message, state: FSMContext):
     name = message.text.strip()
     invite_code = str(uuid4()).split('-')[0].upper()
     team_id = str(uuid4())
-    supabase.table('teams').insert({
+    await db.create_team({
         "id": team_id,
         "name": name,
         "invite_code": invite_code,
-    }).execute()
-    supabase.table('users').update({
+    })
+    await db.update_user_by_tg(message.from_user.id, {
         "team_id": team_id,
         "is_owner": True,
         "is_admin": True,
         "is_active": True,
-    }).eq('telegram_id', message.from_user.id).execute()
+    })
     await message.answer(
         f"Команда <b>{name}</b> создана!\nТвой код для приглашения: <code>{invite_code}</code>\n"
         f"Ты назначен владельцем и администратором.",
@@ -279,19 +354,19 @@ async def btn_join_team(message: types.Message, state: FSMContext):
 @dp.message(JoinTeamState.waiting_for_invite)
 async def join_team_code(message: types.Message, state: FSMContext):
     code = message.text.strip().upper()
-    team = supabase.table('teams').select('id', 'name').eq('invite_code', code).execute().data
+    team = await db.get_team_by_invite(code)
     if not team:
         await message.answer("Команда с таким кодом не найдена. Проверь правильность кода и попробуй снова.")
         return
-    team_id = team[0]['id']
-    update_result = supabase.table('users').update({
+    team_id = team['id']
+    updated = await db.update_user_by_tg(message.from_user.id, {
         "team_id": team_id,
         "is_owner": False,
         "is_admin": False,
         "is_active": True,
-    }).eq('telegram_id', message.from_user.id).execute()
-    if update_result.count == 0:
-        supabase.table('users').insert({
+    })
+    if not updated:
+        await db.create_user({
             "telegram_id": message.from_user.id,
             "name": message.from_user.full_name or message.from_user.username or f"user_{message.from_user.id}",
             "team_id": team_id,
@@ -299,9 +374,9 @@ async def join_team_code(message: types.Message, state: FSMContext):
             "is_admin": False,
             "role": None,
             "is_active": True,
-        }).execute()
+        })
     await message.answer(
-        f"Ты успешно вступил в команду <b>{team[0]['name']}</b>!",
+        f"Ты успешно вступил в команду <b>{team['name']}</b>!",
         parse_mode="HTML",
         reply_markup=menu_keyboard()
     )
@@ -310,55 +385,100 @@ async def join_team_code(message: types.Message, state: FSMContext):
 
 @dp.message(F.text == "📅 Расписание")
 async def btn_schedule(message: types.Message, state: FSMContext):
-    user_resp = supabase.table("users").select("*").eq("telegram_id", message.from_user.id).execute()
-    if not user_resp.data or not user_resp.data[0].get("team_id"):
+    user = await db.get_user_by_tg(message.from_user.id)
+    if not user or not user.get("team_id"):
         await message.answer("Ты не состоишь ни в одной команде.")
         return
-    if not user_resp.data[0].get("is_active", True):
+    if not user.get("is_active", True):
         await message.answer("Твой профиль в команде отключён. Обратись к администратору.")
         return
 
-    team_id = user_resp.data[0]["team_id"]
-    week = get_active_week(team_id)
+    team_id = user["team_id"]
+    week = await db.get_active_week(team_id)
     if not week:
         await message.answer("Нет активной недели. Пусть владелец команды её создаст.")
         return
+    users = await db.list_team_users(team_id, "id,name,role,is_active")
+    shifts = await db.list_shifts(team_id, week["start_date"], week["end_date"])
+
+    await send_schedule(message, team_id, week, users, shifts, "Текущее расписание:", menu_keyboard())
+
+
+async def send_schedule(message: types.Message, team_id: str, week: dict, users: list, shifts: list,
+                        caption: str, reply_markup=None) -> str | None:
+    # Отправляет картинку расписания в чат message и возвращает её file_id
+    # (None — очередь рендера переполнена или картинка ушла документом; пользователю уже ответили)
     week_days = get_week_dates(week["start_date"], week["end_date"])
-    users = supabase.table("users").select("id,name,role,is_active").eq("team_id", team_id).execute().data
-    shifts = supabase.table("shifts").select("*").eq("team_id", team_id).execute().data
-    img_path = make_schedule_image(users, week_days, shifts, team_id)
-    photo = FSInputFile(img_path)
-    await message.answer_photo(photo, caption="Текущее расписание:", reply_markup=menu_keyboard())
+
+    # Ничего не менялось с прошлого показа — переотправляем уже загруженный file_id.
+    # Если ту же картинку уже рендерит другой апдейт — ждём его и берём file_id из кэша.
+    cache_key = schedule_cache.make_key(team_id, week, users, shifts)
+    while True:
+        file_id = schedule_cache.get(cache_key)
+        if file_id:
+            try:
+                await message.answer_photo(file_id, caption=caption, reply_markup=reply_markup)
+                return file_id
+            except TelegramBadRequest:
+                schedule_cache.discard(cache_key)
+        waiting = schedule_cache.begin(cache_key)
+        if waiting is None:
+            break
+        await waiting
+
+    file_id = None
     try:
-        os.remove(img_path)
-    except Exception:
-        pass
+        if renderer.busy:
+            await message.answer("⏳ Готовлю расписание…")
+        t0 = time.perf_counter()
+        try:
+            image = await renderer.render(make_schedule_image, users, week_days, shifts,
+                                          fmt=SCHEDULE_FORMAT, dpi=SCHEDULE_DPI, quality=SCHEDULE_QUALITY)
+        except RenderQueueFull:
+            await message.answer("Сейчас много запросов расписания. Попробуй через минуту.",
+                                 reply_markup=menu_keyboard())
+            return None
+        metrics.observe_render(time.perf_counter() - t0, len(image))
+        photo = BufferedInputFile(image, filename=f"schedule.{SCHEDULE_FORMAT}")
+        try:
+            sent = await message.answer_photo(photo, caption=caption, reply_markup=reply_markup)
+        except TelegramBadRequest:
+            # огромная команда не влезла в ограничения sendPhoto даже с уменьшенным dpi —
+            # отдаём файлом; file_id документа для answer_photo не годится, в кэш не кладём
+            await message.answer_document(photo, caption=caption, reply_markup=reply_markup)
+            return None
+        file_id = sent.photo[-1].file_id
+        schedule_cache.put(team_id, cache_key, file_id)
+        return file_id
+    finally:
+        # ждущие проснутся и возьмут file_id из кэша (или, если не вышло, отрендерят сами)
+        schedule_cache.done(cache_key, file_id)
 
 
 @dp.message(F.text == "👥 Пригласить сотрудника")
 async def btn_invite(message: types.Message, state: FSMContext):
-    user = supabase.table("users").select("team_id").eq("telegram_id", message.from_user.id).execute().data
-    if not user or not user[0].get("team_id"):
+    user = await db.get_user_by_tg(message.from_user.id)
+    if not user or not user.get("team_id"):
         await message.answer("Ты не состоишь ни в одной команде.")
         return
-    team_id = user[0]["team_id"]
-    team = supabase.table("teams").select("invite_code").eq("id", team_id).execute().data
-    invite_code = team[0]["invite_code"] if team and team[0].get("invite_code") else "Нет кода"
+    team_id = user["team_id"]
+    team = await db.get_team(team_id)
+    invite_code = team["invite_code"] if team and team.get("invite_code") else "Нет кода"
     await message.answer(f"Код приглашения для вашей команды: <code>{invite_code}</code>", parse_mode="HTML")
 
 
 @dp.message(F.text == "📝 Моя смена")
 async def myslot_start(message: types.Message, state: FSMContext):
-    user = supabase.table("users").select("*").eq("telegram_id", message.from_user.id).execute().data
-    if not user or not user[0].get("team_id"):
+    user = await db.get_user_by_tg(message.from_user.id)
+    if not user or not user.get("team_id"):
         await message.answer("Ты не состоишь ни в одной команде.")
         return
-    if not user[0].get("is_active", True):
+    if not user.get("is_active", True):
         await message.answer("Твой профиль в команде отключён. Обратись к администратору.")
         return
 
-    team_id = user[0]["team_id"]
-    week = get_active_week(team_id)
+    team_id = user["team_id"]
+    week = await db.get_active_week(team_id)
     if not week:
         await message.answer("Нет активной недели для выбора смены.")
         return
@@ -372,13 +492,13 @@ async def myslot_start(message: types.Message, state: FSMContext):
 @dp.message(F.text == "👤 Выдать роль")
 async def btn_give_role(message: types.Message, state: FSMContext):
     user_id = message.from_user.id
-    user = supabase.table('users').select('id, team_id, is_admin, is_owner').eq('telegram_id', user_id).execute().data
-    if not user or not (user[0].get('is_admin') or user[0].get('is_owner')):
+    user = await db.get_user_by_tg(user_id)
+    if not user or not (user.get('is_admin') or user.get('is_owner')):
         await message.answer("Только админ или владелец команды может выдавать роли.")
         return
 
-    team_id = user[0]['team_id']
-    members = supabase.table('users').select('id, name, role').eq('team_id', team_id).execute().data
+    team_id = user['team_id']
+    members = await db.list_team_users(team_id, "id,name,role")
     if not members:
         await message.answer("В команде нет сотрудников.")
         return
@@ -412,7 +532,7 @@ async def callback_choose_role(call: CallbackQuery, state: FSMContext):
     await call.answer()
 
 
-@dp.callback_query(F.data.startswith("setroleto_"))
+@dp.callback_query(F.data.startswith("setroleto_"), flags=TEAM_LOCK)
 async def callback_set_role(call: CallbackQuery, state: FSMContext):
     role_code = call.data.replace("setroleto_", "")
     data = await state.get_data()
@@ -421,7 +541,7 @@ async def callback_set_role(call: CallbackQuery, state: FSMContext):
         await call.answer("Ошибка: не выбран сотрудник.", show_alert=True)
         return
 
-    supabase.table('users').update({'role': role_code}).eq('id', member_id).execute()
+    await db.update_user(member_id, {'role': role_code})
     await call.message.edit_text("Роль успешно обновлена!")
     await call.answer("Роль назначена.", show_alert=True)
 
@@ -450,12 +570,14 @@ async def slot_choose_day(message: types.Message, state: FSMContext):
     await state.set_state(SlotState.waiting_for_slot)
 
 
+# Без TEAM_LOCK: лимит и запись смены атомарны в book_shift (advisory lock в БД),
+# а лок команды держался бы и на время рендера/отправки расписания после брони.
 @dp.message(SlotState.waiting_for_slot)
 async def slot_choose_slot(message: types.Message, state: FSMContext):
     data = await state.get_data()
     slot = (message.text or "").strip()
 
-    user = supabase.table("users").select("id,team_id,role,is_active").eq("telegram_id", message.from_user.id).execute().data[0]
+    user = await db.get_user_by_tg(message.from_user.id)
     if not user.get("is_active", True):
         await message.answer("Твой профиль в команде отключён. Обратись к администратору.")
         await state.clear()
@@ -466,76 +588,36 @@ async def slot_choose_slot(message: types.Message, state: FSMContext):
     role = user["role"]
     date = data["selected_date"]  # YYYY-MM-DD
 
-    # --- Freeze check: сотрудникам запрещаем менять, если неделя заморожена (админы могут) ---
-    week = get_active_week(team_id)
-    if week and week.get("is_frozen"):
-        me = supabase.table("users").select("is_admin,is_owner").eq("telegram_id", message.from_user.id).execute().data
-        if not me or not ensure_admin(me[0]):
-            await message.answer("🚫 Неделя заморожена. Изменение смен недоступно. Обратись к администратору.")
-            await state.clear()
-            return
-
-    # Если пользователь выбирает "выходной" — пропускаем лимиты
-    if slot in NO_SHIFT:
-        existing = supabase.table("shifts").select("id").eq("user_id", user_id).eq("date", date).eq("team_id", team_id).execute().data
-        if existing:
-            supabase.table("shifts").update({"slot": slot}).eq("id", existing[0]["id"]).execute()
-        else:
-            supabase.table("shifts").insert({"user_id": user_id, "team_id": team_id, "date": date, "slot": slot}).execute()
-        await message.answer(f"✅ Готово! Ты поставил {slot!r} на {date}.", reply_markup=menu_keyboard())
-        await btn_schedule(message, state)
+    # Неделя, заморозка, лимит и запись смены — одна атомарная операция на стороне БД.
+    # Выходной ("-", "вых") лимитами не ограничивается. Счётчики занятости и кэш
+    # недели этого процесса могут отставать от других реплик и правок в обход бота,
+    # поэтому отказ решает только book_shift.
+    res = await db.book_shift(team_id, user_id, date, slot)
+    if res.get("reason") == "frozen":
+        await message.answer("🚫 Неделя заморожена. Изменение смен недоступно. Обратись к администратору.",
+                             reply_markup=menu_keyboard())
+        await state.clear()
+        return
+    if res.get("reason") == "week":
+        await message.answer("🚫 Этот день не входит в активную неделю — её сменили. "
+                             "Открой «📝 Моя смена» ещё раз.", reply_markup=menu_keyboard())
+        await state.clear()
+        return
+    if not res.get("ok"):
+        limit_is_daily = res.get("daily")
+        await message.answer(
+            f"🚫 Лимит для роли «{role}» на {date} "
+            f"{'(на весь день)' if limit_is_daily else f'в слоте {slot}'} исчерпан: "
+            f"{res.get('taken')}/{res.get('max_count')}. Выбери другой слот или день.",
+            reply_markup=menu_keyboard()
+        )
         await state.clear()
         return
 
-    # --- 1) берём все лимиты на этот день и роль (и слот, и дневные) ---
-    lim_rows = supabase.table("limits").select("slot,max_count").eq("team_id", team_id).eq("date", date).eq("role", role).execute().data
-
-    # Выбираем применимый лимит: приоритет точного слота, иначе дневной (slot NULL)
-    max_count = None
-    limit_is_daily = False
-    for r in lim_rows:
-        if r["slot"] == slot:
-            max_count = r["max_count"]
-            limit_is_daily = False
-            break
-    if max_count is None:
-        for r in lim_rows:
-            if r["slot"] is None:
-                max_count = r["max_count"]
-                limit_is_daily = True
-                break
-
-    # --- 2) если лимит задан — проверяем занятость ---
-    if max_count is not None:
-        if limit_is_daily:
-            taken_resp = supabase.table("shifts").select("user_id,slot").eq("team_id", team_id).eq("date", date).execute().data
-            taken_ids = [r["user_id"] for r in taken_resp if r["user_id"] != user_id and (r["slot"] or "").strip() not in NO_SHIFT]
-        else:
-            taken_resp = supabase.table("shifts").select("user_id").eq("team_id", team_id).eq("date", date).eq("slot", slot).execute().data
-            taken_ids = [r["user_id"] for r in taken_resp if r["user_id"] != user_id]
-
-        current_role_count = 0
-        if taken_ids:
-            roles_resp = supabase.table("users").select("id,role,is_active").in_("id", taken_ids).execute().data
-            current_role_count = sum(1 for u in roles_resp if u["role"] == role and u.get("is_active", True))
-
-        if current_role_count >= max_count:
-            await message.answer(
-                f"🚫 Лимит для роли «{role}» на {date} "
-                f"{'(на весь день)' if limit_is_daily else f'в слоте {slot}'} исчерпан: "
-                f"{current_role_count}/{max_count}. Выбери другой слот или день.",
-                reply_markup=menu_keyboard()
-            )
-            await state.clear()
-            return
-
-    existing = supabase.table("shifts").select("id").eq("user_id", user_id).eq("date", date).eq("team_id", team_id).execute().data
-    if existing:
-        supabase.table("shifts").update({"slot": slot}).eq("id", existing[0]["id"]).execute()
+    if slot in NO_SHIFT:
+        await message.answer(f"✅ Готово! Ты поставил {slot!r} на {date}.", reply_markup=menu_keyboard())
     else:
-        supabase.table("shifts").insert({"user_id": user_id, "team_id": team_id, "date": date, "slot": slot}).execute()
-
-    await message.answer(f"✅ Готово! Ты выбрал смену {slot} на {date}.", reply_markup=menu_keyboard())
+        await message.answer(f"✅ Готово! Ты выбрал смену {slot} на {date}.", reply_markup=menu_keyboard())
     await btn_schedule(message, state)
     await state.clear()
 
@@ -543,8 +625,8 @@ async def slot_choose_slot(message: types.Message, state: FSMContext):
 # ---------------- ADMIN PANEL ----------------
 @dp.message(Command("admin"))
 async def admin_entry(message: types.Message, state: FSMContext):
-    me = supabase.table("users").select("id,team_id,is_admin,is_owner").eq("telegram_id", message.from_user.id).execute().data
-    if not me or not ensure_admin(me[0]):
+    me = await db.get_user_by_tg(message.from_user.id)
+    if not ensure_admin(me):
         await message.answer("Доступ только для админов/владельцев.")
         return
     kb = InlineKeyboardBuilder()
@@ -552,21 +634,65 @@ async def admin_entry(message: types.Message, state: FSMContext):
     kb.button(text="🧊 Заморозить неделю / Разморозить", callback_data="admin_freeze_toggle")
     kb.button(text="📈 Лимиты (создать/изменить)", callback_data="admin_limits")
     kb.button(text="👀 Лимиты недели (просмотр)", callback_data="admin_limits_view")
-    kb.button(text="🔁 Скопировать лимиты → след. неделя", callback_data="admin_limits_copy_next")
+    kb.button(text="🔁 Скопировать лимиты вперёд", callback_data="admin_limits_copy_next")
     kb.button(text="✏️ Смены сотрудников", callback_data="admin_shifts")
+    kb.button(text="🗓 Редактор недели", callback_data="admin_grid")
+    kb.button(text="📣 Разослать расписание", callback_data="admin_broadcast")
     kb.button(text="👤 Участники", callback_data="admin_members")
     kb.button(text="♻️ Сбросить инвайт-код", callback_data="admin_reset_invite")
     kb.adjust(1)
     await message.answer("Админ-панель:", reply_markup=kb.as_markup())
 
 
+@dp.message(Command("check_occupancy"))
+async def admin_check_occupancy(message: types.Message, state: FSMContext):
+    me = await db.get_user_by_tg(message.from_user.id)
+    if not ensure_admin(me):
+        await message.answer("Доступ только для админов/владельцев.")
+        return
+    week = await db.get_active_week(me["team_id"])
+    if not week:
+        await message.answer("Нет активной недели.")
+        return
+    drift = await occupancy.check(me["team_id"], week["start_date"], week["end_date"])
+    if not drift:
+        await message.answer("✅ Счётчики занятости совпадают с базой.")
+        return
+    lines = [f"{d} {slot or 'день'} {role}: было {was}, стало {now}" for d, slot, role, was, now in drift[:50]]
+    await message.answer(f"⚠️ Расхождений: {len(drift)} (счётчики пересобраны)\n" + "\n".join(lines))
+
+
+@dp.message(Command("stats"))
+async def admin_stats(message: types.Message, state: FSMContext):
+    me = await db.get_user_by_tg(message.from_user.id)
+    if not ensure_admin(me):
+        await message.answer("Доступ только для админов/владельцев.")
+        return
+    sc = schedule_cache.stats()
+    uc = db.users.stats()
+    qw = limiter.wait.stats()
+    tw = team_locks.wait.stats()
+    sq = send_queue.stats()
+    await message.answer(
+        f"🖼 Кэш расписаний: попаданий {sc['hits']}, промахов {sc['misses']}, "
+        f"ожидали чужой рендер {sc['coalesced']}, записей {sc['entries']}\n"
+        f"👤 Кэш пользователей: попаданий {uc['hits']}, промахов {uc['misses']}, записей {uc['entries']}\n"
+        f"⏱ Очередь апдейтов: в работе {limiter.pending}/{limiter.limit}, "
+        f"ожидание p50 {qw['p50'] * 1000:.0f} мс, p95 {qw['p95'] * 1000:.0f} мс, макс {qw['max'] * 1000:.0f} мс\n"
+        f"🔒 Локи команд: активных {team_locks.active}, захватов {tw['count']}, "
+        f"ожидание p50 {tw['p50'] * 1000:.0f} мс, p95 {tw['p95'] * 1000:.0f} мс, макс {tw['max'] * 1000:.0f} мс\n"
+        f"📨 Рассылка: в очереди {sq['queued'] + sq['in_flight']}, отправлено {sq['sent']}, "
+        f"ошибок {sq['failed']}, повторов {sq['retried']}, ждут дайджеста {notifier.pending}"
+    )
+
+
 # --- Active Week flow ---
 @dp.callback_query(F.data == "admin_week")
 async def admin_week_start(call: CallbackQuery, state: FSMContext):
-    me = supabase.table("users").select("team_id,is_admin,is_owner").eq("telegram_id", call.from_user.id).execute().data
-    if not me or not ensure_admin(me[0]):
+    me = await db.get_user_by_tg(call.from_user.id)
+    if not ensure_admin(me):
         await call.answer("Нет доступа", show_alert=True); return
-    await state.update_data(team_id=me[0]["team_id"])
+    await state.update_data(team_id=me["team_id"])
     txt = ("Введи дату ПОНЕДЕЛЬНИКА в формате YYYY-MM-DD.\n"
            "Я поставлю конец недели = +6 дней и сделаю её активной.")
     await call.message.edit_text(txt)
@@ -574,7 +700,7 @@ async def admin_week_start(call: CallbackQuery, state: FSMContext):
     await call.answer()
 
 
-@dp.message(AdminWeekState.waiting_for_monday)
+@dp.message(AdminWeekState.waiting_for_monday, flags=TEAM_LOCK)
 async def admin_week_set(message: types.Message, state: FSMContext):
     try:
         dt = datetime.strptime(message.text.strip(), "%Y-%m-%d").date()
@@ -586,45 +712,111 @@ async def admin_week_set(message: types.Message, state: FSMContext):
     data = await state.get_data()
     team_id = data["team_id"]
 
-    supabase.table("weeks").update({"is_active": False}).eq("team_id", team_id).eq("is_active", True).execute()
-    supabase.table("weeks").insert({
-        "team_id": team_id,
-        "start_date": monday.isoformat(),
-        "end_date": sunday.isoformat(),
-        "is_active": True,
-        "is_frozen": False,
-    }).execute()
+    await db.set_active_week(team_id, monday.isoformat(), sunday.isoformat())
+    await notify_team(team_id, f"Открыта неделя {monday:%d.%m} — {sunday:%d.%m}. Выбери смены в «📝 Моя смена».",
+                      key="week", actor_tg=message.from_user.id)
 
     await message.answer(f"✅ Неделя {monday} — {sunday} установлена активной.", reply_markup=menu_keyboard())
     await state.clear()
 
 
 # --- Freeze toggle ---
-@dp.callback_query(F.data == "admin_freeze_toggle")
+@dp.callback_query(F.data == "admin_freeze_toggle", flags=TEAM_LOCK)
 async def admin_freeze_toggle(call: CallbackQuery, state: FSMContext):
-    me = supabase.table("users").select("team_id,is_admin,is_owner").eq("telegram_id", call.from_user.id).execute().data
-    if not me or not ensure_admin(me[0]):
+    me = await db.get_user_by_tg(call.from_user.id)
+    if not ensure_admin(me):
         await call.answer("Доступ только для админов/владельцев.", show_alert=True); return
 
-    team_id = me[0]["team_id"]
-    week = get_active_week(team_id)
+    team_id = me["team_id"]
+    week = await db.get_active_week(team_id)
     if not week:
         await call.answer("Нет активной недели.", show_alert=True); return
 
     new_val = not bool(week.get("is_frozen"))
-    supabase.table("weeks").update({"is_frozen": new_val}).eq("id", week["id"]).execute()
+    await db.update_week(week["id"], {"is_frozen": new_val})
+    period = f"{day_label(week['start_date'])} — {day_label(week['end_date'])}"
+    await notify_team(team_id, f"Неделя {period} заморожена: смены менять нельзя." if new_val
+                      else f"Неделя {period} разморожена: смены снова можно менять.",
+                      key="freeze", actor_tg=call.from_user.id)
     await call.answer("🔒 Неделя заморожена." if new_val else "🔓 Неделя разморожена.", show_alert=True)
 
 
+# --- Broadcast: одна загрузка картинки, дальше рассылка по file_id ---
+_broadcasts = {}     # team_id -> задача рассылки
+
+
+@dp.callback_query(F.data == "admin_broadcast")
+async def admin_broadcast(call: CallbackQuery, state: FSMContext):
+    me = await db.get_user_by_tg(call.from_user.id)
+    if not ensure_admin(me):
+        await call.answer("Доступ только для админов/владельцев.", show_alert=True); return
+    team_id = me["team_id"]
+    week = await db.get_active_week(team_id)
+    if not week:
+        await call.answer("Нет активной недели.", show_alert=True); return
+    # между проверкой и записью задачи нет await — две рассылки одной команды не стартуют
+    task = _broadcasts.get(team_id)
+    if task and not task.done():
+        await call.answer("Рассылка уже идёт.", show_alert=True); return
+    # рассылка идёт в фоне — апдейт не держит слот очереди
+    task = _broadcasts[team_id] = asyncio.create_task(
+        _broadcast_schedule(call.message, team_id, week, call.from_user.id))
+    task.add_done_callback(lambda t: _broadcasts.pop(team_id, None) if _broadcasts.get(team_id) is t else None)
+    await call.answer()
+
+
+async def _broadcast_schedule(msg: types.Message, team_id: str, week: dict, actor_tg: int):
+    try:
+        users = await db.list_team_users(team_id, "id,name,role,is_active,telegram_id")
+        shifts = await db.list_shifts(team_id, week["start_date"], week["end_date"])
+        period = f"{day_label(week['start_date'])} — {day_label(week['end_date'])}"
+        caption = f"📅 Расписание на неделю {period}"
+        # картинка рендерится и загружается один раз — в чат админа
+        file_id = await send_schedule(msg, team_id, week, users, shifts, caption)
+        if not file_id:
+            await msg.answer("📣 Рассылка не запущена: расписание не удалось загрузить как фото.")
+            return
+        chat_ids = [u["telegram_id"] for u in users
+                    if u.get("telegram_id") and u.get("is_active", True) and u["telegram_id"] != actor_tg]
+        if not chat_ids:
+            await msg.answer("В команде нет других активных участников.")
+            return
+
+        progress = await msg.answer(f"📣 Рассылка: 0/{len(chat_ids)}")
+
+        async def on_progress(done: int, failed: int):
+            await progress.edit_text(f"📣 Рассылка: {done}/{len(chat_ids)}, ошибок {failed}")
+
+        sent, failed = await fan_out(
+            send_queue, chat_ids,
+            lambda chat_id: lambda b: b.send_photo(chat_id, file_id, caption=caption),
+            on_progress)
+        report = (f"✅ Расписание разослано: доставлено {sent} из {len(chat_ids)}"
+                  + (f", не доставлено {failed} (бот заблокирован или чат недоступен)" if failed else ""))
+        try:
+            await progress.edit_text(report)
+        except Exception as e:
+            # сообщение с прогрессом удалили или его не отредактировать — отчёт новым сообщением
+            log.warning("Рассылка: прогресс не обновлён (%s), отчёт отдельным сообщением", e)
+            await msg.answer(report)
+    except Exception:
+        log.exception("Рассылка расписания команды %s прервалась", team_id)
+        try:
+            await msg.answer("⚠️ Рассылка прервалась из-за ошибки — часть сотрудников могла не получить "
+                             "расписание. Попробуй ещё раз позже.")
+        except Exception:
+            log.exception("Не удалось сообщить админу об ошибке рассылки")
+
+
 # --- Limits flow: создание/изменение ---
 @dp.callback_query(F.data == "admin_limits")
 async def admin_limits_start(call: CallbackQuery, state: FSMContext):
-    me = supabase.table("users").select("team_id,is_admin,is_owner").eq("telegram_id", call.from_user.id).execute().data
-    if not me or not ensure_admin(me[0]):
+    me = await db.get_user_by_tg(call.from_user.id)
+    if not ensure_admin(me):
         await call.answer("Нет доступа", show_alert=True); return
 
-    team_id = me[0]["team_id"]
-    week = get_active_week(team_id)
+    team_id = me["team_id"]
+    week = await db.get_active_week(team_id)
     if not week:
         await call.message.edit_text("Сначала создай активную неделю (меню → 📆 Активная неделя).")
         await call.answer(); return
@@ -697,7 +889,7 @@ async def admin_limits_pick_role(call: CallbackQuery, state: FSMContext):
     await call.answer()
 
 
-@dp.message(AdminLimitsState.waiting_for_count)
+@dp.message(AdminLimitsState.waiting_for_count, flags=TEAM_LOCK)
 async def admin_limits_set_count(message: types.Message, state: FSMContext):
     try:
         n = int(message.text.strip())
@@ -711,18 +903,10 @@ async def admin_limits_set_count(message: types.Message, state: FSMContext):
     role = data["role"]; scope = data.get("scope", "day"); slot = data.get("slot")
 
     if scope == "day":
-        exist = supabase.table("limits").select("id").eq("team_id", team_id).eq("date", date_iso).is_("slot", None).eq("role", role).execute().data
-        if exist:
-            supabase.table("limits").update({"max_count": n}).eq("id", exist[0]["id"]).execute()
-        else:
-            supabase.table("limits").insert({"team_id": team_id, "date": date_iso, "slot": None, "role": role, "max_count": n}).execute()
+        await db.upsert_limits([{"team_id": team_id, "date": date_iso, "slot": None, "role": role, "max_count": n}])
         msg = f"✅ Лимит на день {date_iso} для роли «{role}»: {n}"
     else:
-        exist = supabase.table("limits").select("id").eq("team_id", team_id).eq("date", date_iso).eq("slot", slot).eq("role", role).execute().data
-        if exist:
-            supabase.table("limits").update({"max_count": n}).eq("id", exist[0]["id"]).execute()
-        else:
-            supabase.table("limits").insert({"team_id": team_id, "date": date_iso, "slot": slot, "role": role, "max_count": n}).execute()
+        await db.upsert_limits([{"team_id": team_id, "date": date_iso, "slot": slot, "role": role, "max_count": n}])
         msg = f"✅ Лимит на {date_iso} слот {slot} для роли «{role}»: {n}"
 
     await message.answer(msg, reply_markup=menu_keyboard())
@@ -732,49 +916,59 @@ async def admin_limits_set_count(message: types.Message, state: FSMContext):
 # --- Limits view ---
 @dp.callback_query(F.data == "admin_limits_view")
 async def admin_limits_view(call: CallbackQuery, state: FSMContext):
-    me = supabase.table("users").select("team_id,is_admin,is_owner").eq("telegram_id", call.from_user.id).execute().data
-    if not me or not ensure_admin(me[0]):
+    me = await db.get_user_by_tg(call.from_user.id)
+    if not ensure_admin(me):
         await call.answer("Нет доступа", show_alert=True); return
-    team_id = me[0]["team_id"]
+    team_id = me["team_id"]
 
-    week = get_active_week(team_id)
+    week = await db.get_active_week(team_id)
     if not week:
         await call.message.edit_text("Сначала создай активную неделю (меню → 📆 Активная неделя).")
         await call.answer(); return
 
     days = get_week_dates(week["start_date"], week["end_date"])
 
+    # Лимиты и занятость всей недели — из счётчиков (при промахе: три запроса на неделю)
+    await occupancy.ensure(team_id, week["start_date"], week["end_date"])
+    taken, limits = occupancy.snapshot(team_id)
+
+    limits_by_day = {}
+    for (date_iso, slot, role), max_count in limits.items():
+        rec = limits_by_day.setdefault(date_iso, {}).setdefault(role or "—", {"day": None, "slots": {}})
+        if slot is None:
+            rec["day"] = max_count
+        else:
+            rec["slots"][slot] = max_count
+
     def fmt_one_day_limits(day_iso: str) -> str:
-        rows = supabase.table("limits").select("slot,role,max_count").eq("team_id", team_id).eq("date", day_iso).execute().data
-        if not rows:
+        by_role = limits_by_day.get(day_iso)
+        if not by_role:
             return "—"
-        by_role = {}
-        for r in rows:
-            role = r.get("role") or "—"
-            by_role.setdefault(role, {"day": None, "slots": {}})
-            if r["slot"] is None:
-                by_role[role]["day"] = r["max_count"]
-            else:
-                by_role[role]["slots"][r["slot"]] = r["max_count"]
         parts = []
         for role in sorted(by_role.keys()):
             rec = by_role[role]
             chunk = f"{role}: "
             sub = []
             if rec["day"] is not None:
-                sub.append(f"день={rec['day']}")
+                sub.append(f"день={taken.get((day_iso, None, role), 0)}/{rec['day']}")
             if rec["slots"]:
-                slot_str = ", ".join(f"{s}={cnt}" for s, cnt in sorted(rec["slots"].items()))
+                slot_str = ", ".join(f"{s}={taken.get((day_iso, s, role), 0)}/{cnt}"
+                                     for s, cnt in sorted(rec["slots"].items()))
                 sub.append(slot_str)
             chunk += "; ".join(sub) if sub else "—"
             parts.append(chunk)
         return " | ".join(parts)
 
-    header = f"📊 Лимиты на неделю {week['start_date']} — {week['end_date']}\n"
+    def day_headcount(day_iso: str) -> int:
+        return sum(cnt for (d, slot, _), cnt in taken.items() if d == day_iso and slot is None)
+
+    header = (f"📊 Лимиты на неделю {week['start_date']} — {week['end_date']}\n"
+              f"(занято/максимум)\n")
     msg = header
     sent_any = False
     for d in days:
-        line = f"{d['weekday']} {d['date']}: {fmt_one_day_limits(d['date_iso'])}\n"
+        line = (f"{d['weekday']} {d['date']} [в смене: {day_headcount(d['date_iso'])}]: "
+                f"{fmt_one_day_limits(d['date_iso'])}\n")
         if len(msg) + len(line) > 3500:
             await call.message.answer(msg)
             msg = ""
@@ -795,16 +989,18 @@ async def admin_limits_view(call: CallbackQuery, state: FSMContext):
 
 @dp.callback_query(F.data == "admin_back")
 async def admin_back(call: CallbackQuery, state: FSMContext):
-    me = supabase.table("users").select("id,team_id,is_admin,is_owner").eq("telegram_id", call.from_user.id).execute().data
-    if not me or not ensure_admin(me[0]):
+    me = await db.get_user_by_tg(call.from_user.id)
+    if not ensure_admin(me):
         await call.answer("Нет доступа", show_alert=True); return
     kb = InlineKeyboardBuilder()
     kb.button(text="📆 Активная неделя", callback_data="admin_week")
     kb.button(text="🧊 Заморозить неделю / Разморозить", callback_data="admin_freeze_toggle")
     kb.button(text="📈 Лимиты (создать/изменить)", callback_data="admin_limits")
     kb.button(text="👀 Лимиты недели (просмотр)", callback_data="admin_limits_view")
-    kb.button(text="🔁 Скопировать лимиты → след. неделя", callback_data="admin_limits_copy_next")
+    kb.button(text="🔁 Скопировать лимиты вперёд", callback_data="admin_limits_copy_next")
     kb.button(text="✏️ Смены сотрудников", callback_data="admin_shifts")
+    kb.button(text="🗓 Редактор недели", callback_data="admin_grid")
+    kb.button(text="📣 Разослать расписание", callback_data="admin_broadcast")
     kb.button(text="👤 Участники", callback_data="admin_members")
     kb.button(text="♻️ Сбросить инвайт-код", callback_data="admin_reset_invite")
     kb.adjust(1)
@@ -812,69 +1008,63 @@ async def admin_back(call: CallbackQuery, state: FSMContext):
     await call.answer()
 
 
-# --- Limits copy to next week ---
+# --- Limits copy to next weeks ---
+COPY_WEEKS_CHOICES = [1, 2, 4, 8]
+
+
 @dp.callback_query(F.data == "admin_limits_copy_next")
 async def admin_limits_copy_next(call: CallbackQuery, state: FSMContext):
-    me = supabase.table("users").select("team_id,is_admin,is_owner").eq("telegram_id", call.from_user.id).execute().data
-    if not me or not ensure_admin(me[0]):
+    me = await db.get_user_by_tg(call.from_user.id)
+    if not ensure_admin(me):
         await call.answer("Нет доступа", show_alert=True); return
-    team_id = me[0]["team_id"]
 
-    week = get_active_week(team_id)
+    kb = InlineKeyboardBuilder()
+    for n in COPY_WEEKS_CHOICES:
+        kb.button(text=f"→ {n} нед.", callback_data=f"limits_copy:{n}")
+    kb.button(text="⬅️ Назад", callback_data="admin_back")
+    kb.adjust(len(COPY_WEEKS_CHOICES), 1)
+    await call.message.edit_text("На сколько недель вперёд скопировать лимиты активной недели?",
+                                 reply_markup=kb.as_markup())
+    await call.answer()
+
+
+@dp.callback_query(F.data.startswith("limits_copy:"), flags=TEAM_LOCK)
+async def admin_limits_copy_weeks(call: CallbackQuery, state: FSMContext):
+    weeks = int(call.data.split(":")[1])
+    me = await db.get_user_by_tg(call.from_user.id)
+    if not ensure_admin(me):
+        await call.answer("Нет доступа", show_alert=True); return
+    team_id = me["team_id"]
+
+    week = await db.get_active_week(team_id)
     if not week:
         await call.message.edit_text("Сначала создай активную неделю (меню → 📆 Активная неделя).")
         await call.answer(); return
 
-    start = datetime.strptime(week["start_date"], "%Y-%m-%d").date()
-    end = datetime.strptime(week["end_date"], "%Y-%m-%d").date()
-
-    rows = supabase.table("limits").select("date,slot,role,max_count") \
-        .eq("team_id", team_id).gte("date", start.isoformat()).lte("date", end.isoformat()).execute().data
+    t0 = time.perf_counter()
+    copied = await db.copy_limits(team_id, week["start_date"], week["end_date"], weeks)
+    elapsed = time.perf_counter() - t0
 
-    if not rows:
+    if not copied:
         await call.message.edit_text("На активной неделе нет лимитов для копирования.")
         await call.answer(); return
 
-    inserted = 0
-    updated = 0
-    for r in rows:
-        src_date = datetime.strptime(r["date"], "%Y-%m-%d").date()
-        dst_date = (src_date + timedelta(days=7)).isoformat()
-        role = r["role"]
-        slot = r["slot"]  # может быть None
-        max_count = r["max_count"]
-
-        q = supabase.table("limits").select("id").eq("team_id", team_id).eq("date", dst_date).eq("role", role)
-        if slot is None:
-            q = q.is_("slot", None)
-        else:
-            q = q.eq("slot", slot)
-        exist = q.execute().data
-
-        if exist:
-            supabase.table("limits").update({"max_count": max_count}).eq("id", exist[0]["id"]).execute()
-            updated += 1
-        else:
-            supabase.table("limits").insert({
-                "team_id": team_id, "date": dst_date, "slot": slot, "role": role, "max_count": max_count
-            }).execute()
-            inserted += 1
-
+    end = datetime.strptime(week["end_date"], "%Y-%m-%d").date() + timedelta(days=7 * weeks)
     await call.message.edit_text(
-        f"✅ Скопировано лимитов на следующую неделю: добавлено {inserted}, обновлено {updated}."
+        f"✅ Лимиты скопированы на {weeks} нед. вперёд (по {end}): {copied} строк за {elapsed:.2f} с."
     )
     await call.answer()
 
 
 # --- Reset invite code ---
-@dp.callback_query(F.data == "admin_reset_invite")
+@dp.callback_query(F.data == "admin_reset_invite", flags=TEAM_LOCK)
 async def admin_reset_invite(call: CallbackQuery, state: FSMContext):
-    me = supabase.table("users").select("team_id,is_admin,is_owner").eq("telegram_id", call.from_user.id).execute().data
-    if not me or not ensure_admin(me[0]):
+    me = await db.get_user_by_tg(call.from_user.id)
+    if not ensure_admin(me):
         await call.answer("Нет доступа", show_alert=True); return
-    team_id = me[0]["team_id"]
+    team_id = me["team_id"]
     new_code = str(uuid4()).split("-")[0].upper()
-    supabase.table("teams").update({"invite_code": new_code}).eq("id", team_id).execute()
+    await db.update_team(team_id, {"invite_code": new_code})
     await call.message.edit_text(f"♻️ Новый инвайт-код: <code>{new_code}</code>", parse_mode="HTML")
     await call.answer()
 
@@ -888,71 +1078,113 @@ def _member_badges(u: dict) -> str:
     return "".join(badges)
 
 
-def _paginate(items, page, size):
-    total = len(items)
-    start = page * size
-    end = start + size
-    return items[start:end], total
-
-
-@dp.callback_query(F.data == "admin_members")
-async def admin_members_start(call: CallbackQuery, state: FSMContext):
-    me = supabase.table("users").select("team_id,is_admin,is_owner").eq("telegram_id", call.from_user.id).execute().data
-    if not me or not ensure_admin(me[0]):
-        await call.answer("Нет доступа", show_alert=True); return
-    team_id = me[0]["team_id"]
+MEMBER_COLUMNS = "id,name,role,is_admin,is_owner,is_active"
 
-    members = supabase.table("users").select("id,name,role,is_admin,is_owner,is_active") \
-        .eq("team_id", team_id).order("name").execute().data
-
-    await state.update_data(members_cache=members)  # кэш на время просмотра
-    await _render_members_page(call.message, members, page=0)
-    await state.set_state(AdminMembersState.browsing)
-    await call.answer()
 
+# Список участников постранично по ключу (name, id): в FSM лежит только курсор
+# страницы (первая/последняя строка, номер, всего, поиск), каждая страница —
+# один запрос к БД и одно редактирование сообщения.
+async def _show_members(msg: types.Message, state: FSMContext, team_id: str, page: int,
+                        after=None, before=None, prefix: str = None, total: int = None, edit: bool = True):
+    if total is None:
+        total = await db.count_team_users(team_id, prefix)
+    rows = await db.list_team_users_page(team_id, MEMBER_COLUMNS, limit=PAGE_SIZE,
+                                         after=after, before=before, prefix=prefix)
+    if before is not None:
+        rows = rows[-PAGE_SIZE:]      # лишняя строка в начале — предыдущие страницы
+        has_next = True
+    else:
+        has_next = len(rows) > PAGE_SIZE
+        rows = rows[:PAGE_SIZE]
 
-async def _render_members_page(msg: types.Message, members: list, page: int):
-    page_items, total = _paginate(members, page, PAGE_SIZE)
     kb = InlineKeyboardBuilder()
-    for u in page_items:
+    for u in rows:
         label = f"{_member_badges(u)} {u['name']} ({u.get('role') or '—'})"
         kb.button(text=label[:64], callback_data=f"member_open:{u['id']}")
-    # навигация
-    nav = InlineKeyboardBuilder()
-    if page > 0:
-        nav.button(text="⬅️ Назад", callback_data=f"members_page:{page-1}")
-    if (page + 1) * PAGE_SIZE < total:
-        nav.button(text="Вперёд ➡️", callback_data=f"members_page:{page+1}")
-    nav.adjust(2)
     kb.adjust(1)
-    text = f"👤 Участники (стр. {page+1})"
-    await msg.edit_text(text, reply_markup=kb.as_markup())
-    if nav.buttons:
-        await msg.answer("Навигация:", reply_markup=nav.as_markup())
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton(text="⬅️ Назад", callback_data="members_page:prev"))
+    if has_next:
+        nav.append(InlineKeyboardButton(text="Вперёд ➡️", callback_data="members_page:next"))
+    if nav:
+        kb.row(*nav)
+    if prefix:
+        kb.row(InlineKeyboardButton(text="✖️ Сбросить поиск", callback_data="admin_members"))
+    else:
+        kb.row(InlineKeyboardButton(text="🔎 Поиск по имени", callback_data="members_search"))
+    kb.row(InlineKeyboardButton(text="⬅️ В меню", callback_data="admin_back"))
+
+    pages = max(1, -(-total // PAGE_SIZE))
+    title = f"👤 Участники: {total}" + (f" · поиск «{prefix}»" if prefix else "") + f" (стр. {page + 1}/{pages})"
+    if not rows:
+        title += "\nНикого не найдено."
+    if edit:
+        await msg.edit_text(title, reply_markup=kb.as_markup())
+    else:
+        await msg.answer(title, reply_markup=kb.as_markup())
+
+    await state.update_data(members_nav={
+        "page": page, "total": total, "prefix": prefix,
+        "first": [rows[0]["name"], rows[0]["id"]] if rows else None,
+        "last": [rows[-1]["name"], rows[-1]["id"]] if rows else None,
+    })
+    await state.set_state(AdminMembersState.browsing)
+
+
+@dp.callback_query(F.data == "admin_members")
+async def admin_members_start(call: CallbackQuery, state: FSMContext):
+    me = await db.get_user_by_tg(call.from_user.id)
+    if not ensure_admin(me):
+        await call.answer("Нет доступа", show_alert=True); return
+    await _show_members(call.message, state, me["team_id"], page=0)
+    await call.answer()
 
 
 @dp.callback_query(AdminMembersState.browsing, F.data.startswith("members_page:"))
 async def members_page_nav(call: CallbackQuery, state: FSMContext):
-    page = int(call.data.split(":")[1])
-    data = await state.get_data()
-    members = data.get("members_cache", [])
-    await _render_members_page(call.message, members, page)
+    me = await db.get_user_by_tg(call.from_user.id)
+    if not ensure_admin(me):
+        await call.answer("Нет доступа", show_alert=True); return
+    nav = (await state.get_data()).get("members_nav")
+    if not nav or not nav["first"]:
+        await admin_members_start(call, state); return
+    if call.data.endswith(":next"):
+        await _show_members(call.message, state, me["team_id"], nav["page"] + 1, after=tuple(nav["last"]),
+                            prefix=nav["prefix"], total=nav["total"])
+    else:
+        await _show_members(call.message, state, me["team_id"], max(0, nav["page"] - 1), before=tuple(nav["first"]),
+                            prefix=nav["prefix"], total=nav["total"])
     await call.answer()
 
 
+@dp.callback_query(AdminMembersState.browsing, F.data == "members_search")
+async def members_search_start(call: CallbackQuery, state: FSMContext):
+    await call.message.edit_text("🔎 Введи начало имени:")
+    await state.set_state(AdminMembersState.waiting_for_search)
+    await call.answer()
+
+
+@dp.message(AdminMembersState.waiting_for_search)
+async def members_search(message: types.Message, state: FSMContext):
+    me = await db.get_user_by_tg(message.from_user.id)
+    if not ensure_admin(me):
+        await message.answer("Доступ только для админов/владельцев."); return
+    prefix = (message.text or "").strip()[:40] or None
+    await _show_members(message, state, me["team_id"], page=0, prefix=prefix, edit=False)
+
+
 @dp.callback_query(F.data.startswith("member_open:"))
 async def member_open(call: CallbackQuery, state: FSMContext):
     member_id = call.data.split(":")[1]
-    me = supabase.table("users").select("team_id,is_admin,is_owner,id").eq("telegram_id", call.from_user.id).execute().data[0]
+    me = await db.get_user_by_tg(call.from_user.id)
     if not ensure_admin(me):
         await call.answer("Нет доступа", show_alert=True); return
     team_id = me["team_id"]
 
-    rows = supabase.table("users").select("id,name,role,is_admin,is_owner,is_active,telegram_id") \
-        .eq("id", member_id).eq("team_id", team_id).execute().data
-    if not rows:
+    u = await db.get_team_member(member_id, team_id)
+    if not u:
         await call.answer("Пользователь не найден.", show_alert=True); return
-    u = rows[0]
 
     text = (
         f"{_member_badges(u)} <b>{u['name']}</b>\n"
@@ -987,61 +1219,60 @@ async def member_open(call: CallbackQuery, state: FSMContext):
     await call.answer()
 
 
-@dp.callback_query(F.data.startswith("member_setrole:"))
+@dp.callback_query(F.data.startswith("member_setrole:"), flags=TEAM_LOCK)
 async def member_setrole(call: CallbackQuery, state: FSMContext):
     _, user_id, role = call.data.split(":")
-    me = supabase.table("users").select("team_id,is_admin,is_owner").eq("telegram_id", call.from_user.id).execute().data[0]
+    me = await db.get_user_by_tg(call.from_user.id)
     if not ensure_admin(me):
         await call.answer("Нет доступа", show_alert=True); return
-    supabase.table("users").update({"role": role}).eq("id", user_id).eq("team_id", me["team_id"]).execute()
+    await db.update_user(user_id, {"role": role}, team_id=me["team_id"])
     await call.answer("Роль обновлена")
     await member_open(call, state)
 
 
-@dp.callback_query(F.data.startswith("member_admin_toggle:"))
+@dp.callback_query(F.data.startswith("member_admin_toggle:"), flags=TEAM_LOCK)
 async def member_admin_toggle(call: CallbackQuery, state: FSMContext):
     user_id = call.data.split(":")[1]
-    me = supabase.table("users").select("team_id,is_admin,is_owner,id").eq("telegram_id", call.from_user.id).execute().data[0]
+    me = await db.get_user_by_tg(call.from_user.id)
     if not ensure_admin(me):
         await call.answer("Нет доступа", show_alert=True); return
-    rows = supabase.table("users").select("is_admin,is_owner").eq("id", user_id).eq("team_id", me["team_id"]).execute().data
-    if not rows:
+    u = await db.get_team_member(user_id, me["team_id"])
+    if not u:
         await call.answer("Не найдено", show_alert=True); return
-    u = rows[0]
     if u.get("is_owner"):
         await call.answer("Нельзя изменять права владельца.", show_alert=True); return
-    supabase.table("users").update({"is_admin": not u.get("is_admin", False)}).eq("id", user_id).execute()
+    await db.update_user(user_id, {"is_admin": not u.get("is_admin", False)})
     await call.answer("Готово")
     await member_open(call, state)
 
 
-@dp.callback_query(F.data.startswith("member_toggle_active:"))
+@dp.callback_query(F.data.startswith("member_toggle_active:"), flags=TEAM_LOCK)
 async def member_toggle_active(call: CallbackQuery, state: FSMContext):
     user_id = call.data.split(":")[1]
-    me = supabase.table("users").select("team_id,is_admin,is_owner").eq("telegram_id", call.from_user.id).execute().data[0]
+    me = await db.get_user_by_tg(call.from_user.id)
     if not ensure_admin(me):
         await call.answer("Нет доступа", show_alert=True); return
-    rows = supabase.table("users").select("is_active").eq("id", user_id).eq("team_id", me["team_id"]).execute().data
-    if not rows:
+    u = await db.get_team_member(user_id, me["team_id"])
+    if not u:
         await call.answer("Не найдено", show_alert=True); return
-    curr = rows[0].get("is_active", True)
+    curr = u.get("is_active", True)
     if curr:
-        supabase.table("users").update({"is_active": False, "left_at": now_iso_z(), "is_admin": False}).eq("id", user_id).execute()
+        await db.update_user(user_id, {"is_active": False, "left_at": now_iso_z(), "is_admin": False})
     else:
-        supabase.table("users").update({"is_active": True, "left_at": None}).eq("id", user_id).execute()
+        await db.update_user(user_id, {"is_active": True, "left_at": None})
     await call.answer("Статус изменён")
     await member_open(call, state)
 
 
-@dp.callback_query(F.data.startswith("member_remove:"))
+@dp.callback_query(F.data.startswith("member_remove:"), flags=TEAM_LOCK)
 async def member_remove(call: CallbackQuery, state: FSMContext):
     user_id = call.data.split(":")[1]
-    me = supabase.table("users").select("team_id,is_admin,is_owner,id").eq("telegram_id", call.from_user.id).execute().data[0]
+    me = await db.get_user_by_tg(call.from_user.id)
     if not ensure_admin(me):
         await call.answer("Нет доступа", show_alert=True); return
     if me["id"] == user_id:
         await call.answer("Нельзя удалить самого себя.", show_alert=True); return
-    supabase.table("users").update({"team_id": None, "is_admin": False, "is_active": False}).eq("id", user_id).eq("team_id", me["team_id"]).execute()
+    await db.update_user(user_id, {"team_id": None, "is_admin": False, "is_active": False}, team_id=me["team_id"])
     await call.answer("Пользователь удалён из команды")
     await admin_members_start(call, state)
 
@@ -1049,12 +1280,12 @@ async def member_remove(call: CallbackQuery, state: FSMContext):
 # --- Admin: shifts editor (правка чужих смен, без учёта заморозки/лимитов) ---
 @dp.callback_query(F.data == "admin_shifts")
 async def admin_shifts_start(call: CallbackQuery, state: FSMContext):
-    me = supabase.table("users").select("team_id,is_admin,is_owner").eq("telegram_id", call.from_user.id).execute().data
-    if not me or not ensure_admin(me[0]):
+    me = await db.get_user_by_tg(call.from_user.id)
+    if not ensure_admin(me):
         await call.answer("Нет доступа", show_alert=True); return
-    team_id = me[0]["team_id"]
+    team_id = me["team_id"]
 
-    members = supabase.table("users").select("id,name,role,is_active").eq("team_id", team_id).order("name").execute().data
+    members = await db.list_team_users(team_id, "id,name,role,is_active", order="name")
     kb = InlineKeyboardBuilder()
     for u in members:
         status = "" if u.get("is_active", True) else " (🔴)"
@@ -1069,9 +1300,9 @@ async def admin_shifts_start(call: CallbackQuery, state: FSMContext):
 @dp.callback_query(AdminShiftsState.choosing_user, F.data.startswith("shift_user:"))
 async def admin_shifts_pick_user(call: CallbackQuery, state: FSMContext):
     user_id = call.data.split(":")[1]
-    me = supabase.table("users").select("team_id").eq("telegram_id", call.from_user.id).execute().data[0]
+    me = await db.get_user_by_tg(call.from_user.id)
     team_id = me["team_id"]
-    week = get_active_week(team_id)
+    week = await db.get_active_week(team_id)
     if not week:
         await call.answer("Нет активной недели.", show_alert=True); return
     days = get_week_dates(week["start_date"], week["end_date"])
@@ -1110,42 +1341,349 @@ async def admin_shifts_action_set(call: CallbackQuery, state: FSMContext):
     await call.answer()
 
 
-@dp.callback_query(F.data.startswith("shift_slot:"))
+@dp.callback_query(F.data.startswith("shift_slot:"), flags=TEAM_LOCK)
 async def admin_shifts_set_slot(call: CallbackQuery, state: FSMContext):
-    _, user_id, date_iso, slot = call.data.split(":")
-    me = supabase.table("users").select("team_id").eq("telegram_id", call.from_user.id).execute().data[0]
+    # в слоте есть двоеточия ("10:00-23:00") — режем только первые три
+    _, user_id, date_iso, slot = call.data.split(":", 3)
+    me = await db.get_user_by_tg(call.from_user.id)
     team_id = me["team_id"]
 
     # Админ-правка: нарочно игнорируем лимиты и заморозку
-    existing = supabase.table("shifts").select("id").eq("user_id", user_id).eq("date", date_iso).eq("team_id", team_id).execute().data
-    if existing:
-        supabase.table("shifts").update({"slot": slot}).eq("id", existing[0]["id"]).execute()
-    else:
-        supabase.table("shifts").insert({"user_id": user_id, "team_id": team_id, "date": date_iso, "slot": slot}).execute()
+    await db.upsert_shifts([{"user_id": user_id, "team_id": team_id, "date": date_iso, "slot": slot}])
+    await notify_member(team_id, user_id,
+                        f"{day_label(date_iso)}: {'выходной' if slot in NO_SHIFT else f'смена {slot}'} (правка админа)",
+                        key=("shift", date_iso), actor_tg=call.from_user.id)
 
     await call.answer("Смена обновлена", show_alert=True)
     await admin_shifts_start(call, state)
 
 
-@dp.callback_query(F.data.startswith("shift_action:clear:"))
+@dp.callback_query(F.data.startswith("shift_action:clear:"), flags=TEAM_LOCK)
 async def admin_shifts_clear(call: CallbackQuery, state: FSMContext):
     _, _, user_id, date_iso = call.data.split(":")
-    me = supabase.table("users").select("team_id").eq("telegram_id", call.from_user.id).execute().data[0]
+    me = await db.get_user_by_tg(call.from_user.id)
     team_id = me["team_id"]
 
-    supabase.table("shifts").delete().eq("user_id", user_id).eq("team_id", team_id).eq("date", date_iso).execute()
+    await db.delete_shift(team_id, user_id, date_iso)
+    await notify_member(team_id, user_id, f"{day_label(date_iso)}: смена снята админом",
+                        key=("shift", date_iso), actor_tg=call.from_user.id)
     await call.answer("Смена удалена", show_alert=True)
     await admin_shifts_start(call, state)
 
 
+# --- Bulk week editor ---
+# Правки копятся в FSM (grid_pending: "user_id|date" -> слот или None = снять смену)
+# поверх снимка смен недели (grid_base) и пишутся одним upsert (+ одним delete для
+# снятых смен). «Кисть» выбирается один раз, дальше каждое нажатие на ячейку
+# красит её без запросов к БД. Сотрудники и дни в callback_data — индексами.
+GRID_BRUSHES = STD_SLOTS + ["выходной", None]     # None — снять смену
+
+
+def _grid_short(slot) -> str:
+    if slot is None:
+        return "—"
+    if slot.strip().lower() in NO_SHIFT:
+        return "вых"
+    return slot.split("-")[0]
+
+
+def _grid_cell(data: dict, user_id: str, date_iso: str) -> str:
+    key = f"{user_id}|{date_iso}"
+    if key in data["grid_pending"]:
+        return _grid_short(data["grid_pending"][key]) + " •"
+    return _grid_short(data["grid_base"].get(key))
+
+
+def _grid_paint(data: dict, cells: list):
+    slot = GRID_BRUSHES[data["grid_brush"]]
+    for user_id, date_iso in cells:
+        key = f"{user_id}|{date_iso}"
+        if data["grid_base"].get(key) == slot:
+            data["grid_pending"].pop(key, None)    # вернули как было — правки нет
+        else:
+            data["grid_pending"][key] = slot
+
+
+def _grid_merged(data: dict) -> dict:
+    merged = dict(data["grid_base"])
+    merged.update(data["grid_pending"])
+    return {k: v for k, v in merged.items() if v is not None}
+
+
+async def _grid_show(msg: types.Message, state: FSMContext, data: dict):
+    members, days = data["grid_members"], data["grid_days"]
+    view = data["grid_view"]
+    kb = InlineKeyboardBuilder()
+    if view[0] != "home":
+        brushes = [InlineKeyboardButton(
+            text=("🖌" if i == data["grid_brush"] else "") + ("✖" if b is None else _grid_short(b)),
+            callback_data=f"grid_brush:{i}") for i, b in enumerate(GRID_BRUSHES)]
+        kb.row(*brushes[:4])
+        kb.row(*brushes[4:])
+
+    if view[0] == "user":
+        ui = view[1]
+        user_id, name = members[ui][0], members[ui][1]
+        title = f"👤 {name}"
+        for di, d in enumerate(days):
+            kb.row(InlineKeyboardButton(text=f"{d['weekday']} {d['date']}: {_grid_cell(data, user_id, d['date_iso'])}",
+                                        callback_data=f"grid_cell:{ui}:{di}"))
+        kb.row(InlineKeyboardButton(text="🖌 Вся неделя", callback_data="grid_fill"),
+               InlineKeyboardButton(text="↩️ К списку", callback_data="grid_view:home:0"))
+    else:
+        page = view[-1]
+        chunk = list(enumerate(members))[page * PAGE_SIZE:(page + 1) * PAGE_SIZE]
+        if view[0] == "day":
+            di = view[1]
+            d = days[di]
+            title = f"📅 {d['weekday']} {d['date']}"
+            for ui, (user_id, name, _role) in chunk:
+                kb.row(InlineKeyboardButton(text=f"{name}: {_grid_cell(data, user_id, d['date_iso'])}"[:64],
+                                            callback_data=f"grid_cell:{ui}:{di}"))
+        else:
+            title = "Выбери день или сотрудника"
+            kb.row(*[InlineKeyboardButton(text=d["weekday"], callback_data=f"grid_view:day:{di}:{page}")
+                     for di, d in enumerate(days)])
+            for ui, (user_id, name, _role) in chunk:
+                edits = sum(1 for d in days if f"{user_id}|{d['date_iso']}" in data["grid_pending"])
+                kb.row(InlineKeyboardButton(text=(f"{name} ✏️{edits}" if edits else name)[:64],
+                                            callback_data=f"grid_view:user:{ui}"))
+        base = "grid_view:" + ":".join(str(v) for v in view[:-1])
+        nav = []
+        if page > 0:
+            nav.append(InlineKeyboardButton(text="⬅️", callback_data=f"{base}:{page - 1}"))
+        if (page + 1) * PAGE_SIZE < len(members):
+            nav.append(InlineKeyboardButton(text="➡️", callback_data=f"{base}:{page + 1}"))
+        if nav:
+            kb.row(*nav)
+        if view[0] == "day":
+            kb.row(InlineKeyboardButton(text="🖌 Всем на странице", callback_data="grid_fill"),
+                   InlineKeyboardButton(text="↩️ К списку", callback_data=f"grid_view:home:{page}"))
+
+    n = len(data["grid_pending"])
+    if view[0] == "home":
+        kb.row(InlineKeyboardButton(text="🤖 Автозаполнение по лимитам", callback_data="grid_autofill"))
+    kb.row(InlineKeyboardButton(text="🖼 Превью", callback_data="grid_preview"),
+           InlineKeyboardButton(text=f"✅ Сохранить ({n})", callback_data="grid_apply"))
+    kb.row(InlineKeyboardButton(text="🗑 Сбросить правки", callback_data="grid_discard"),
+           InlineKeyboardButton(text="⬅️ Выход", callback_data="admin_back"))
+    period = f"{day_label(days[0]['date_iso'])} — {day_label(days[-1]['date_iso'])}"
+    text = (f"🗓 Редактор недели {period}\n{title}\n"
+            f"Несохранённых правок: {n} (отмечены •)")
+    await state.update_data(grid_view=view)
+    try:
+        await msg.edit_text(text, reply_markup=kb.as_markup())
+    except TelegramBadRequest:
+        pass    # «message is not modified» — перекрасили ячейку тем же слотом
+
+
+@dp.callback_query(F.data == "admin_grid")
+async def admin_grid_start(call: CallbackQuery, state: FSMContext):
+    me = await db.get_user_by_tg(call.from_user.id)
+    if not ensure_admin(me):
+        await call.answer("Нет доступа", show_alert=True); return
+    team_id = me["team_id"]
+    week = await db.get_active_week(team_id)
+    if not week:
+        await call.answer("Нет активной недели.", show_alert=True); return
+    members = await db.list_team_users(team_id, "id,name,role,is_active", order="name")
+    shifts = await db.list_shifts(team_id, week["start_date"], week["end_date"])
+    data = {
+        "grid_team": team_id,
+        "grid_members": [[u["id"], u["name"], u.get("role")] for u in members if u.get("is_active", True)],
+        "grid_days": get_week_dates(week["start_date"], week["end_date"]),
+        "grid_base": {f"{s['user_id']}|{s['date']}": s["slot"] for s in shifts},
+        "grid_pending": {},
+        "grid_brush": 0,
+        "grid_view": ["home", 0],
+    }
+    if not data["grid_members"]:
+        await call.answer("В команде нет активных сотрудников.", show_alert=True); return
+    await state.set_state(AdminGridState.editing)
+    await state.set_data(data)
+    await _grid_show(call.message, state, data)
+    await call.answer()
+
+
+@dp.callback_query(AdminGridState.editing, F.data.startswith("grid_view:"))
+async def grid_view(call: CallbackQuery, state: FSMContext):
+    kind, *args = call.data.split(":")[1:]
+    data = await state.get_data()
+    await _grid_show(call.message, state, {**data, "grid_view": [kind, *map(int, args)]})
+    await call.answer()
+
+
+@dp.callback_query(AdminGridState.editing, F.data.startswith("grid_brush:"))
+async def grid_brush(call: CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    data["grid_brush"] = int(call.data.split(":")[1])
+    await state.update_data(grid_brush=data["grid_brush"])
+    await _grid_show(call.message, state, data)
+    await call.answer()
+
+
+@dp.callback_query(AdminGridState.editing, F.data.startswith("grid_cell:"))
+async def grid_cell(call: CallbackQuery, state: FSMContext):
+    _, ui, di = call.data.split(":")
+    data = await state.get_data()
+    _grid_paint(data, [(data["grid_members"][int(ui)][0], data["grid_days"][int(di)]["date_iso"])])
+    await state.update_data(grid_pending=data["grid_pending"])
+    await _grid_show(call.message, state, data)
+    await call.answer()
+
+
+@dp.callback_query(AdminGridState.editing, F.data == "grid_fill")
+async def grid_fill(call: CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    view, members, days = data["grid_view"], data["grid_members"], data["grid_days"]
+    if view[0] == "user":
+        cells = [(members[view[1]][0], d["date_iso"]) for d in days]
+    elif view[0] == "day":
+        page = view[2]
+        cells = [(m[0], days[view[1]]["date_iso"]) for m in members[page * PAGE_SIZE:(page + 1) * PAGE_SIZE]]
+    else:
+        cells = []
+    _grid_paint(data, cells)
+    await state.update_data(grid_pending=data["grid_pending"])
+    await _grid_show(call.message, state, data)
+    await call.answer()
+
+
+@dp.callback_query(AdminGridState.editing, F.data == "grid_discard")
+async def grid_discard(call: CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    data["grid_pending"] = {}
+    await state.update_data(grid_pending={})
+    await _grid_show(call.message, state, data)
+    await call.answer("Правки сброшены")
+
+
+async def _grid_preview(msg: types.Message, data: dict, caption: str):
+    # черновик рендерится как обычное расписание, но в кэш file_id не попадает
+    users = [{"id": uid, "name": name, "role": role, "is_active": True} for uid, name, role in data["grid_members"]]
+    shifts = [{"user_id": k.split("|")[0], "date": k.split("|")[1], "slot": v}
+              for k, v in _grid_merged(data).items()]
+    t0 = time.perf_counter()
+    try:
+        image = await renderer.render(make_schedule_image, users, data["grid_days"], shifts,
+                                      fmt=SCHEDULE_FORMAT, dpi=SCHEDULE_DPI, quality=SCHEDULE_QUALITY)
+    except RenderQueueFull:
+        await msg.answer("Сейчас много запросов расписания. Попробуй через минуту."); return
+    metrics.observe_render(time.perf_counter() - t0, len(image))
+    await msg.answer_photo(BufferedInputFile(image, filename=f"draft.{SCHEDULE_FORMAT}"), caption=caption)
+
+
+@dp.callback_query(AdminGridState.editing, F.data == "grid_preview")
+async def grid_preview(call: CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    await call.answer()
+    await _grid_preview(call.message, data, f"Черновик: несохранённых правок {len(data['grid_pending'])}")
+
+
+# Автозаполнение: свободные места по лимитам недели раскладываются (autofill.auto_fill)
+# поверх черновика и попадают в него как обычные правки — их можно поправить руками
+# и сохранить тем же пакетом.
+@dp.callback_query(AdminGridState.editing, F.data == "grid_autofill")
+async def grid_autofill(call: CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    days = data["grid_days"]
+    limits = await db.list_limits(data["grid_team"], date_from=days[0]["date_iso"], date_to=days[-1]["date_iso"],
+                                  columns="date,slot,role,max_count")
+    if not limits:
+        await call.answer("На эту неделю нет лимитов — нечего заполнять.", show_alert=True); return
+    members = [{"id": uid, "name": name, "role": role, "is_active": True} for uid, name, role in data["grid_members"]]
+    shifts = [{"user_id": k.split("|")[0], "date": k.split("|")[1], "slot": v}
+              for k, v in _grid_merged(data).items()]
+    result = auto_fill([d["date_iso"] for d in days], members, shifts, limits, STD_SLOTS,
+                       max_days=AUTOFILL_MAX_DAYS)
+    if not result["assign"]:
+        await call.answer("Свободных мест, которые можно закрыть, нет.", show_alert=True); return
+
+    auto = set(data.get("grid_auto", []))
+    for row in result["assign"]:
+        key = f"{row['user_id']}|{row['date']}"
+        data["grid_pending"][key] = row["slot"]
+        auto.add(key)
+    data["grid_auto"] = sorted(auto)
+    await state.update_data(grid_pending=data["grid_pending"], grid_auto=data["grid_auto"])
+    await call.answer()
+    await _grid_show(call.message, state, data)
+
+    roles = dict((code, title) for title, code in ROLE_CODES)
+    missing = sum(n for *_, n in result["unfilled"])
+    caption = f"🤖 Автозаполнение: назначено смен {len(result['assign'])}"
+    if missing:
+        lines = [f"{day_label(d)} {slot} {roles.get(role, role)}: −{n}" for d, slot, role, n in result["unfilled"][:10]]
+        caption += f"\nНе закрыто мест: {missing} (не хватает людей)\n" + "\n".join(lines)
+    await _grid_preview(call.message, data, caption[:1024])
+
+
+@dp.callback_query(AdminGridState.editing, F.data == "grid_apply", flags=TEAM_LOCK)
+async def grid_apply(call: CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    team_id, pending = data["grid_team"], data["grid_pending"]
+    if not pending:
+        await call.answer("Нет несохранённых правок.", show_alert=True); return
+    # авто-назначения не перетирают смены, которые успели забронировать после раскладки
+    skipped = 0
+    if data.get("grid_auto"):
+        days = data["grid_days"]
+        current = await db.list_shifts(team_id, days[0]["date_iso"], days[-1]["date_iso"])
+        taken = {f"{s['user_id']}|{s['date']}" for s in current} - set(data["grid_base"])
+        for key in taken.intersection(data["grid_auto"]):
+            if pending.pop(key, None) is not None:
+                skipped += 1
+    upserts, deletes = [], []
+    for key, slot in pending.items():
+        user_id, date_iso = key.split("|")
+        if slot is None:
+            deletes.append((user_id, date_iso))
+        else:
+            upserts.append({"user_id": user_id, "team_id": team_id, "date": date_iso, "slot": slot})
+
+    # Админ-правка: как и поштучная, игнорирует лимиты и заморозку
+    await db.upsert_shifts(upserts)
+    await db.delete_shifts(team_id, deletes)
+    tg_ids = {u["id"]: u.get("telegram_id") for u in await db.list_team_users(team_id, "id,telegram_id")}
+    for key, slot in pending.items():
+        user_id, date_iso = key.split("|")
+        tg = tg_ids.get(user_id)
+        if tg and tg != call.from_user.id:
+            line = ("смена снята админом" if slot is None
+                    else "выходной (правка админа)" if slot in NO_SHIFT else f"смена {slot} (правка админа)")
+            notifier.notify(tg, f"{day_label(date_iso)}: {line}", key=("shift", date_iso))
+
+    await state.clear()
+    await call.message.edit_text(f"✅ Сохранено правок: {len(pending)} "
+                                 f"(назначено {len(upserts)}, снято {len(deletes)})."
+                                 + (f"\nПропущено авто-назначений: {skipped} — день уже занят." if skipped else ""))
+    await call.answer()
+
+
 # ---------------- RUN ----------------
 if __name__ == "__main__":
-    import asyncio, logging, sys
+    import sys
     logging.basicConfig(level=logging.INFO)
-    print("Бот стартует... запускаю polling")
     if sys.platform == "win32":
         asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
-    try:
-        dp.run_polling(bot)
-    finally:
-        print("Polling завершён")
+    if BOT_MODE == "webhook":
+        if not WEBHOOK_BASE_URL or not WEBHOOK_SECRET:
+            print("ERROR: для BOT_MODE=webhook нужны WEBHOOK_BASE_URL и WEBHOOK_SECRET")
+            raise SystemExit(1)
+        from webhook import run_webhook
+        print(f"Бот стартует... webhook на {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+        try:
+            run_webhook(dp, bot, limiter, base_url=WEBHOOK_BASE_URL, path=WEBHOOK_PATH,
+                        secret=WEBHOOK_SECRET, host=WEBHOOK_HOST, port=WEBHOOK_PORT)
+        finally:
+            renderer.shutdown()
+            db.close()
+            print("Webhook остановлен")
+    else:
+        print("Бот стартует... запускаю polling")
+        try:
+            dp.run_polling(bot)
+        finally:
+            renderer.shutdown()
+            db.close()
+            print("Polling завершён")
@@ -0,0 +1,132 @@
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+
+
+# ---------------- TTL + LRU ----------------
+# Словарь с ограничением по времени жизни записи и по размеру (вытесняется
+# самая давно использованная запись).
+class TTLCache:
+    def __init__(self, ttl: float = 300, max_size: int = 10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()   # key -> (expires_at, value)
+
+    def get(self, key):
+        item = self._data.get(key)
+        if item is None or item[0] < time.monotonic():
+            if item is not None:
+                del self._data[key]
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._data.move_to_end(key)
+        return item[1]
+
+    def put(self, key, value):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def pop(self, key):
+        item = self._data.pop(key, None)
+        return item[1] if item else None
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._data)}
+
+
+# ---------------- SCHEDULE CACHE ----------------
+# Ключ — хэш всего, что видно на картинке; значение — file_id уже загруженного
+# в Telegram изображения. Повторный просмотр без изменений = отправка file_id
+# без рендера и загрузки. Одновременные промахи по одному ключу не рендерят
+# параллельно: первый (begin() вернул None) рендерит и отдаёт file_id через
+# done(), остальные ждут его future.
+class ScheduleCache:
+    # изменения в этих таблицах меняют картинку расписания
+    TABLES = {"users", "shifts", "weeks"}
+
+    def __init__(self, max_entries: int = 512):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._entries = OrderedDict()   # key -> (team_id, file_id)
+        self._inflight = {}             # key -> Future[file_id | None]
+
+    @staticmethod
+    def make_key(team_id: str, week: dict, users: list, shifts: list, background=None) -> str:
+        visible = sorted(
+            (u["id"], u["name"], u.get("role") or "")
+            for u in users if u.get("is_active", True)
+        )
+        start, end = week["start_date"], week["end_date"]
+        week_shifts = sorted(
+            (s["user_id"], s["date"], s["slot"] or "")
+            for s in shifts if start <= s["date"] <= end
+        )
+        payload = json.dumps(
+            [team_id, week.get("id"), start, end, visible, week_shifts, background],
+            ensure_ascii=False, default=str,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def put(self, team_id: str, key: str, file_id: str):
+        self._entries[key] = (team_id, file_id)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def begin(self, key: str):
+        # None — рендерить этому вызову; иначе future с file_id (None — рендер не удался)
+        fut = self._inflight.get(key)
+        if fut is not None:
+            self.coalesced += 1
+            return asyncio.shield(fut)
+        self._inflight[key] = asyncio.get_running_loop().create_future()
+        return None
+
+    def done(self, key: str, file_id):
+        fut = self._inflight.pop(key, None)
+        if fut is not None and not fut.done():
+            fut.set_result(file_id)
+
+    def discard(self, key: str):
+        self._entries.pop(key, None)
+
+    def invalidate(self, team_id: str):
+        for key in [k for k, (t, _) in self._entries.items() if t == team_id]:
+            del self._entries[key]
+
+    def on_change(self, table: str, op: str, rows: list, team_id: str = None):
+        if table not in self.TABLES:
+            return
+        teams = {r.get("team_id") for r in rows}
+        teams.add(team_id)
+        teams.discard(None)
+        for t in teams:
+            self.invalidate(t)
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "coalesced": self.coalesced,
+                "entries": len(self._entries)}
@@ -0,0 +1,199 @@
+import logging
+import time
+from bisect import bisect_left
+from typing import Any, Awaitable, Callable
+
+from aiohttp import web
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.types import TelegramObject
+
+from middlewares import handler_name
+
+log = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+BYTES_BUCKETS = (16_384, 65_536, 131_072, 262_144, 524_288, 1_048_576, 2_097_152, 5_242_880)
+
+
+# ---------------- PROMETHEUS TEXT FORMAT ----------------
+# Минимальные Counter/Histogram/Gauge в текстовом формате Prometheus 0.0.4 —
+# без prometheus_client. Метки — кортеж значений в порядке labels.
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _num(x: float) -> str:
+    return str(int(x)) if float(x).is_integer() else repr(float(x))
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels=()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self._values = {}
+
+    def inc(self, *labels, value: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + value
+
+    def samples(self):
+        for key, v in sorted(self._values.items()):
+            yield f"{self.name}{_labels(self.labels, key)} {_num(v)}"
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}   # labels -> [counts по бакетам (последний — +Inf), sum]
+
+    def observe(self, *labels, value: float):
+        entry = self._values.setdefault(labels, [[0] * (len(self.buckets) + 1), 0.0])
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    def samples(self):
+        for key, (counts, total) in sorted(self._values.items()):
+            acc = 0
+            for le, c in zip(self.buckets + (float("inf"),), counts):
+                acc += c
+                bound = "+Inf" if le == float("inf") else _num(le)
+                le_label = f'le="{bound}"'
+                yield f"{self.name}_bucket{_labels(self.labels, key, le_label)} {acc}"
+            yield f"{self.name}_sum{_labels(self.labels, key)} {_num(total)}"
+            yield f"{self.name}_count{_labels(self.labels, key)} {acc}"
+
+
+class Gauge:
+    # значение снимается при каждом запросе /metrics
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, fn: Callable[[], float]):
+        self.name, self.help, self.fn = name, help, fn
+
+    def samples(self):
+        yield f"{self.name} {_num(self.fn())}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for m in self._metrics:
+            lines.append(f"# HELP {m.name} {m.help}")
+            lines.append(f"# TYPE {m.name} {m.kind}")
+            lines.extend(m.samples())
+        return "\n".join(lines) + "\n"
+
+
+# ---------------- BOT METRICS ----------------
+# Всё, что снимает бот: хендлеры, запросы к БД (Repo.observers), рендер
+# расписания и вызовы Telegram Bot API (middleware сессии бота).
+class Metrics:
+    def __init__(self):
+        self.registry = r = Registry()
+        self.handler_seconds = r.add(Histogram(
+            "bot_handler_seconds", "Время обработки апдейта хендлером", ("handler",)))
+        self.handler_errors = r.add(Counter(
+            "bot_handler_errors_total", "Исключения в хендлерах", ("handler", "error")))
+        self.db_seconds = r.add(Histogram(
+            "bot_db_query_seconds", "Время запроса к Supabase", ("table", "op")))
+        self.db_errors = r.add(Counter(
+            "bot_db_query_errors_total", "Ошибки запросов к Supabase", ("table", "op")))
+        self.db_rows = r.add(Counter(
+            "bot_db_rows_total", "Строк в ответах Supabase", ("table", "op")))
+        self.render_seconds = r.add(Histogram(
+            "bot_render_seconds", "Время рендера расписания (с ожиданием очереди)"))
+        self.render_bytes = r.add(Histogram(
+            "bot_render_bytes", "Размер картинки расписания", buckets=BYTES_BUCKETS))
+        self.tg_seconds = r.add(Histogram(
+            "bot_telegram_request_seconds", "Время вызова Telegram Bot API", ("method",)))
+        self.tg_errors = r.add(Counter(
+            "bot_telegram_request_errors_total", "Ошибки вызовов Telegram Bot API", ("method", "error")))
+
+    def gauge(self, name: str, help: str, fn: Callable[[], float]):
+        self.registry.add(Gauge(name, help, fn))
+
+    # --- Repo.observers ---
+    def on_query(self, table: str, op: str, query, rows, seconds: float, error=None):
+        self.db_seconds.observe(table, op, value=seconds)
+        if error is not None:
+            self.db_errors.inc(table, op)
+        else:
+            # rpc возвращает объект, а не список строк
+            self.db_rows.inc(table, op, value=len(rows) if isinstance(rows, list) else 1)
+
+    def observe_render(self, seconds: float, size: int):
+        self.render_seconds.observe(value=seconds)
+        self.render_bytes.observe(value=size)
+
+
+# Внутренний middleware на dp.message / dp.callback_query: хендлер уже выбран
+# фильтрами, поэтому метка — имя функции хендлера.
+class HandlerMetrics(BaseMiddleware):
+    def __init__(self, metrics: Metrics):
+        self.metrics = metrics
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        name = handler_name(data)
+        t0 = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            self.metrics.handler_errors.inc(name, type(e).__name__)
+            raise
+        finally:
+            self.metrics.handler_seconds.observe(name, value=time.perf_counter() - t0)
+
+
+class TelegramMetrics(BaseRequestMiddleware):
+    def __init__(self, metrics: Metrics):
+        self.metrics = metrics
+
+    async def __call__(self, make_request, bot, method):
+        name = getattr(method, "__api_method__", type(method).__name__)
+        t0 = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            self.metrics.tg_errors.inc(name, type(e).__name__)
+            raise
+        finally:
+            self.metrics.tg_seconds.observe(name, value=time.perf_counter() - t0)
+
+
+# ---------------- /metrics ENDPOINT ----------------
+# Отдельный aiohttp-сервер (по умолчанию только localhost), не связанный с webhook.
+async def start_server(metrics: Metrics, host: str = "127.0.0.1", port: int = 9100) -> web.AppRunner:
+    async def handle(_request):
+        return web.Response(body=metrics.registry.render().encode(),
+                            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    log.info("Metrics: http://%s:%d/metrics", host, port)
+    return runner
@@ -0,0 +1,114 @@
+import asyncio
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import TelegramObject
+
+
+def handler_name(data: dict[str, Any]) -> str:
+    # имя функции хендлера, выбранного фильтрами (есть только во внутренних middleware)
+    h = data.get("handler")
+    return getattr(getattr(h, "callback", None), "__name__", "unknown")
+
+
+# ---------------- WAIT STATS ----------------
+# Время ожидания в очереди: счётчики за всё время + перцентили по последним
+# window замерам.
+class WaitStats:
+    def __init__(self, window: int = 1000):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._recent = deque(maxlen=window)
+
+    def observe(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self._recent.append(seconds)
+
+    def stats(self) -> dict:
+        recent = sorted(self._recent)
+
+        def pct(q):
+            return recent[min(len(recent) - 1, int(q * len(recent)))] if recent else 0.0
+
+        return {"count": self.count, "avg": self.total / self.count if self.count else 0.0,
+                "p50": pct(0.5), "p95": pct(0.95), "max": self.max}
+
+
+# ---------------- CONCURRENCY LIMIT ----------------
+# Внешний middleware на dp.update: не больше limit апдейтов обрабатываются
+# одновременно, остальные ждут очереди. Работает одинаково для polling и webhook
+# (в webhook-режиме апдейты принимаются сразу и ждут здесь, а не у Telegram).
+class ConcurrencyLimit(BaseMiddleware):
+    def __init__(self, limit: int = 64):
+        self.limit = limit
+        self._sem = asyncio.Semaphore(limit)
+        self.pending = 0    # ждут + выполняются
+        self.wait = WaitStats()
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        self.pending += 1
+        t0 = time.perf_counter()
+        try:
+            async with self._sem:
+                self.wait.observe(time.perf_counter() - t0)
+                return await handler(event, data)
+        finally:
+            self.pending -= 1
+
+    async def drain(self, timeout: float = 30) -> bool:
+        # ждём, пока доработают принятые апдейты; False — не успели за timeout
+        deadline = time.monotonic() + timeout
+        while self.pending and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        return not self.pending
+
+
+# ---------------- TEAM LOCKS ----------------
+# Внутренний middleware (на dp.message / dp.callback_query — после фильтров,
+# когда известен хендлер): хендлеры с флагом team_lock одной команды выполняются
+# строго по очереди, разные команды друг друга не ждут. Команда определяется
+# resolve_team(event) -> team_id | None; без команды лок не берётся.
+class TeamLocks(BaseMiddleware):
+    def __init__(self, resolve_team: Callable[[TelegramObject], Awaitable[Any]]):
+        self.resolve_team = resolve_team
+        self._locks = {}    # team_id -> [Lock, сколько держат/ждут]
+        self.wait = WaitStats()
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        if not get_flag(data, "team_lock"):
+            return await handler(event, data)
+        team_id = await self.resolve_team(event)
+        if team_id is None:
+            return await handler(event, data)
+        entry = self._locks.setdefault(team_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        t0 = time.perf_counter()
+        try:
+            async with entry[0]:
+                self.wait.observe(time.perf_counter() - t0)
+                return await handler(event, data)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                # лок никому не нужен — не копим словарь по всем командам
+                del self._locks[team_id]
+
+    @property
+    def active(self) -> int:
+        return len(self._locks)
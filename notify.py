@@ -0,0 +1,213 @@
+import asyncio
+import heapq
+import logging
+import time
+from itertools import count
+from typing import Any, Awaitable, Callable
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramForbiddenError, TelegramNetworkError, TelegramRetryAfter, TelegramServerError,
+)
+
+log = logging.getLogger(__name__)
+
+
+# ---------------- SEND QUEUE ----------------
+# Очередь исходящих сообщений с учётом лимитов Telegram: не больше rate отправок
+# в секунду на бота и не чаще раза в chat_interval секунд в один чат.
+# RetryAfter (flood control) ставит на паузу всю очередь на указанное время и
+# повторяет сообщение; сетевые/5xx ошибки повторяются с экспоненциальной
+# задержкой, остальные (бот заблокирован, чат не найден) — сразу в failed.
+# submit() возвращает future с результатом отправки.
+class _Job:
+    __slots__ = ("chat_id", "call", "future", "attempts")
+
+    def __init__(self, chat_id: int, call, future):
+        self.chat_id = chat_id
+        self.call = call
+        self.future = future
+        self.attempts = 0
+
+
+class SendQueue:
+    def __init__(self, bot: Bot, rate: float = 25, chat_interval: float = 1.0,
+                 max_in_flight: int = 8, max_attempts: int = 5):
+        self.bot = bot
+        self.rate = rate
+        self.chat_interval = chat_interval
+        self.max_in_flight = max_in_flight
+        self.max_attempts = max_attempts
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self._heap = []                 # (готово_к_отправке, seq, job)
+        self._seq = count()
+        self._chat_next = {}            # chat_id -> когда можно слать в чат
+        self._next_slot = 0.0           # когда можно следующую отправку (глобально)
+        self._paused_until = 0.0        # flood control
+        self._in_flight = set()
+        self._wake = None
+        self._worker = None
+
+    def __len__(self) -> int:
+        return len(self._heap) + len(self._in_flight)
+
+    def submit(self, chat_id: int, call: Callable[[Bot], Awaitable[Any]]) -> asyncio.Future:
+        # call(bot) — сама отправка, например lambda b: b.send_message(chat_id, text)
+        loop = asyncio.get_running_loop()
+        job = _Job(chat_id, call, loop.create_future())
+        self._push(job, time.monotonic())
+        if self._worker is None or self._worker.done():
+            self._wake = asyncio.Event()
+            self._worker = loop.create_task(self._run())
+        self._wake.set()
+        return job.future
+
+    def _push(self, job: _Job, ready: float):
+        heapq.heappush(self._heap, (ready, next(self._seq), job))
+
+    async def _sleep(self, delay: float):
+        # ждём delay или новой задачи в очереди
+        self._wake.clear()
+        try:
+            await asyncio.wait_for(self._wake.wait(), timeout=delay)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _run(self):
+        while self._heap or self._in_flight:
+            now = time.monotonic()
+            if not self._heap or len(self._in_flight) >= self.max_in_flight:
+                await self._sleep(0.05)
+                continue
+            ready, _, job = self._heap[0]
+            start = max(ready, self._next_slot, self._paused_until)
+            if start > now:
+                await self._sleep(start - now)
+                continue
+            heapq.heappop(self._heap)
+            chat_ready = self._chat_next.get(job.chat_id, 0.0)
+            if chat_ready > now:
+                self._push(job, chat_ready)      # в этот чат ещё рано — не блокируем остальных
+                continue
+            self._chat_next[job.chat_id] = now + self.chat_interval
+            self._next_slot = now + 1 / self.rate
+            task = asyncio.create_task(self._send(job))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+            if len(self._chat_next) > 10_000:
+                self._chat_next = {c: t for c, t in self._chat_next.items() if t > now}
+
+    async def _send(self, job: _Job):
+        job.attempts += 1
+        try:
+            result = await job.call(self.bot)
+        except TelegramRetryAfter as e:
+            self.retried += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+            log.warning("SendQueue: flood control, пауза %s с", e.retry_after)
+            self._retry(job, e.retry_after, e)
+        except (TelegramNetworkError, TelegramServerError) as e:
+            self.retried += 1
+            self._retry(job, min(2 ** job.attempts, 60), e)
+        except TelegramForbiddenError as e:
+            self._fail(job, e)
+        except Exception as e:
+            log.warning("SendQueue: не доставлено в %s: %s", job.chat_id, e)
+            self._fail(job, e)
+        else:
+            self.sent += 1
+            if not job.future.done():
+                job.future.set_result(result)
+
+    def _retry(self, job: _Job, delay: float, error: Exception):
+        if job.attempts >= self.max_attempts:
+            self._fail(job, error)
+            return
+        self._push(job, time.monotonic() + delay)
+        if self._wake is not None:
+            self._wake.set()
+
+    def _fail(self, job: _Job, error: Exception):
+        self.failed += 1
+        if not job.future.done():
+            job.future.set_exception(error)
+            job.future.exception()      # не ругаться «exception was never retrieved»
+
+    async def close(self, timeout: float = 10):
+        # дожидаемся отправки накопленного, затем останавливаем воркер
+        if self._worker is None:
+            return
+        try:
+            await asyncio.wait_for(asyncio.shield(self._worker), timeout)
+        except asyncio.TimeoutError:
+            log.warning("SendQueue: остановка с %d неотправленными", len(self))
+            self._worker.cancel()
+
+    def stats(self) -> dict:
+        return {"queued": len(self._heap), "in_flight": len(self._in_flight),
+                "sent": self.sent, "failed": self.failed, "retried": self.retried}
+
+
+# ---------------- NOTIFIER ----------------
+# Уведомления копятся по получателю window секунд и уходят одним сообщением-
+# дайджестом. Строки с одинаковым key заменяют друг друга (две правки одной
+# смены — одна строка с итоговым значением).
+class Notifier:
+    def __init__(self, queue: SendQueue, window: float = 10):
+        self.queue = queue
+        self.window = window
+        self._pending = {}      # chat_id -> {key: line}
+        self._timers = {}       # chat_id -> TimerHandle
+
+    def notify(self, chat_id: int, line: str, key=None):
+        lines = self._pending.setdefault(chat_id, {})
+        if key is None:
+            key = ("line", len(lines))
+        lines.pop(key, None)    # обновлённая строка — в конец
+        lines[key] = line
+        if chat_id not in self._timers:
+            loop = asyncio.get_running_loop()
+            self._timers[chat_id] = loop.call_later(self.window, self._flush, chat_id)
+
+    def _flush(self, chat_id: int):
+        self._timers.pop(chat_id, None)
+        lines = self._pending.pop(chat_id, None)
+        if not lines:
+            return
+        text = "🔔 Изменения в расписании:\n" + "\n".join(f"• {line}" for line in lines.values())
+        self.queue.submit(chat_id, lambda bot: bot.send_message(chat_id, text))
+
+    def flush_all(self):
+        for chat_id, timer in list(self._timers.items()):
+            timer.cancel()
+            self._flush(chat_id)
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+
+# ---------------- FAN-OUT ----------------
+# Одна и та же отправка многим чатам через очередь. on_progress(done, failed)
+# вызывается не чаще раза в interval секунд и в конце; ошибка в нём рассылку
+# не прерывает. Возвращает (доставлено, ошибок).
+async def fan_out(queue: SendQueue, chat_ids, make_call: Callable[[int], Callable[[Bot], Awaitable[Any]]],
+                  on_progress: Callable[[int, int], Awaitable[Any]] = None, interval: float = 2.0) -> tuple:
+    futures = [queue.submit(chat_id, make_call(chat_id)) for chat_id in chat_ids]
+    done = failed = 0
+    last = time.monotonic()
+    for fut in asyncio.as_completed(futures):
+        try:
+            await fut
+        except Exception:
+            failed += 1
+        done += 1
+        if on_progress is not None and (done == len(futures) or time.monotonic() - last >= interval):
+            last = time.monotonic()
+            try:
+                await on_progress(done, failed)
+            except Exception as e:
+                log.warning("fan_out: прогресс не обновлён: %s", e)
+    return done - failed, failed
@@ -0,0 +1,147 @@
+import time
+
+NO_SHIFT = {"-", "вых", "выходной"}  # значения, не считающиеся сменой
+
+
+# ---------------- OCCUPANCY ----------------
+# Занятость по лимитам:
+#   (date, slot, role) — сколько человек роли стоит в слоте,
+#   (date, None, role) — сколько человек роли работает в этот день (любой слот).
+# Отключённые сотрудники не считаются — как и в проверке лимита при бронировании.
+def _occupancy_keys(date: str, slot, role) -> set:
+    if (slot or "").strip() in NO_SHIFT:
+        return set()
+    return {(date, slot, role), (date, None, role)}
+
+
+def count_occupancy(shifts: list, users: list) -> dict:
+    roles = {u["id"]: u.get("role") for u in users if u.get("is_active", True)}
+    counts = {}
+    for s in shifts:
+        if s["user_id"] not in roles:
+            continue
+        for key in _occupancy_keys(s["date"], s["slot"], roles[s["user_id"]]):
+            counts[key] = counts.get(key, 0) + 1
+    return counts
+
+
+class _TeamOccupancy:
+    def __init__(self, date_from: str, date_to: str, members: list, shifts: list, limits: list):
+        self.date_from = date_from
+        self.date_to = date_to
+        self.loaded_at = time.monotonic()
+        self.members = {u["id"]: (u.get("role"), u.get("is_active", True)) for u in members}
+        self.shifts = {(s["user_id"], s["date"]): s["slot"] for s in shifts}
+        self.limits = {(r["date"], r["slot"], r["role"]): r["max_count"] for r in limits}
+        self.counts = count_occupancy(shifts, members)
+
+    def covers(self, date: str) -> bool:
+        return self.date_from <= date <= self.date_to
+
+    def _contribution(self, user_id: str, date: str) -> set:
+        role, active = self.members.get(user_id, (None, False))
+        if not active or (user_id, date) not in self.shifts:
+            return set()
+        return _occupancy_keys(date, self.shifts[(user_id, date)], role)
+
+    def _add(self, keys: set, delta: int):
+        for key in keys:
+            self.counts[key] = self.counts.get(key, 0) + delta
+            if not self.counts[key]:
+                del self.counts[key]
+
+    def set_shift(self, user_id: str, date: str, slot, deleted: bool = False):
+        self._add(self._contribution(user_id, date), -1)
+        if deleted:
+            self.shifts.pop((user_id, date), None)
+        else:
+            self.shifts[(user_id, date)] = slot
+        self._add(self._contribution(user_id, date), +1)
+
+    def set_member(self, user_id: str, role, active: bool, in_team: bool):
+        dates = [d for (uid, d) in self.shifts if uid == user_id]
+        for d in dates:
+            self._add(self._contribution(user_id, d), -1)
+        if in_team:
+            self.members[user_id] = (role, active)
+        else:
+            self.members.pop(user_id, None)
+        for d in dates:
+            self._add(self._contribution(user_id, d), +1)
+
+
+# Счётчики занятости по командам в памяти процесса. Загружаются окном дат
+# (обычно активная неделя) тремя запросами, дальше поддерживаются
+# инкрементально по записям бота (Repo.listeners). ttl ограничивает
+# расхождение с изменениями, сделанными в обход этого процесса.
+# Счётчики только для показа (экран лимитов у админа) и сверки с БД (check):
+# решение о брони принимает book_shift в БД.
+class Occupancy:
+    def __init__(self, repo, ttl: float = 60):
+        self.repo = repo
+        self.ttl = ttl
+        self._teams = {}   # team_id -> _TeamOccupancy
+
+    def _get(self, team_id: str):
+        team = self._teams.get(team_id)
+        if team is not None and time.monotonic() - team.loaded_at > self.ttl:
+            del self._teams[team_id]
+            return None
+        return team
+
+    async def _load(self, team_id: str, date_from: str, date_to: str) -> _TeamOccupancy:
+        members = await self.repo.list_team_users(team_id, "id,role,is_active")
+        shifts = await self.repo.list_shifts(team_id, date_from, date_to)
+        limits = await self.repo.list_limits(team_id, date_from=date_from, date_to=date_to,
+                                             columns="date,slot,role,max_count")
+        return _TeamOccupancy(date_from, date_to, members, shifts, limits)
+
+    async def ensure(self, team_id: str, date_from: str, date_to: str) -> _TeamOccupancy:
+        team = self._get(team_id)
+        if team is None or not (team.covers(date_from) and team.covers(date_to)):
+            team = self._teams[team_id] = await self._load(team_id, date_from, date_to)
+        return team
+
+    def invalidate(self, team_id: str):
+        self._teams.pop(team_id, None)
+
+    def snapshot(self, team_id: str):
+        team = self._get(team_id)
+        if team is None:
+            return {}, {}
+        return dict(team.counts), dict(team.limits)
+
+    # --- инкрементальные обновления из Repo.listeners ---
+    def on_change(self, table: str, op: str, rows: list, team_id: str = None):
+        if table == "shifts":
+            for r in rows:
+                team = self._get(r.get("team_id") or team_id)
+                if team is not None and team.covers(r["date"]):
+                    team.set_shift(r["user_id"], r["date"], r.get("slot"), deleted=(op == "delete"))
+        elif table == "users":
+            for r in rows:
+                for tid, team in list(self._teams.items()):
+                    if r["id"] in team.members or r.get("team_id") == tid:
+                        team.set_member(r["id"], r.get("role"), r.get("is_active", True),
+                                        in_team=(r.get("team_id") == tid))
+        elif table == "limits":
+            for r in rows:
+                team = self._get(r.get("team_id") or team_id)
+                if team is not None and team.covers(r["date"]):
+                    team.limits[(r["date"], r["slot"], r["role"])] = r["max_count"]
+
+    # --- проверка согласованности ---
+    async def check(self, team_id: str, date_from: str, date_to: str) -> list:
+        # Пересобирает счётчики из БД и возвращает расхождения
+        # [(date, slot, role, было, стало)]; пересобранные счётчики заменяют старые.
+        old = self._get(team_id)
+        fresh = await self._load(team_id, date_from, date_to)
+        drift = []
+        if old is not None:
+            keys = {k for k in set(old.counts) | set(fresh.counts) if old.covers(k[0]) and fresh.covers(k[0])}
+            for key in sorted(keys, key=lambda k: (k[0], k[1] or "", k[2] or "")):
+                was, now = old.counts.get(key, 0), fresh.counts.get(key, 0)
+                if was != now:
+                    drift.append((*key, was, now))
+        self._teams[team_id] = fresh
+        return drift
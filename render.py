@@ -0,0 +1,282 @@
+import asyncio
+import io
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
+
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+from PIL import Image, ImageDraw, ImageFont
+
+
+ROLE_HEADERS = {'Официанты', 'Бармен', 'Хостес', 'Ранеры', 'Админы', 'Стажёры', 'Другие'}
+
+
+# ---------------- OUTPUT FORMAT ----------------
+# Картинка отдаётся байтами (без временных файлов). png/webp — с прозрачными
+# полями, jpeg — на белом фоне; quality — для webp/jpeg.
+IMAGE_FORMATS = {"png": "PNG", "webp": "WEBP", "jpeg": "JPEG"}
+# sendPhoto не принимает картинки, у которых ширина + высота больше 10000 px:
+# большие команды рендерятся с пониженным dpi, чтобы влезть (с запасом на поля)
+PHOTO_MAX_SIDES = 9_600
+
+
+def _encode(img: "Image.Image", fmt: str, dpi: int, quality: int) -> bytes:
+    buf = io.BytesIO()
+    if fmt == "jpeg":
+        flat = Image.new("RGB", img.size, "white")
+        flat.paste(img, mask=img.getchannel("A"))
+        flat.save(buf, "JPEG", quality=quality, dpi=(dpi, dpi), optimize=True)
+    elif fmt == "webp":
+        img.save(buf, "WEBP", quality=quality, method=4)
+    else:
+        img.save(buf, "PNG", dpi=(dpi, dpi), compress_level=3)
+    return buf.getvalue()
+
+
+# ---------------- SCHEDULE RENDER ----------------
+ROLE_MAP = {
+    "employee": "Официанты",
+    "barman": "Бармен",
+    "host": "Хостес",
+    "runner": "Ранеры",
+    "admin": "Админы",
+    "trainee": "Стажёры",
+}
+ROLES_ORDER = ["employee", "barman", "host", "runner", "admin", "trainee", "other"]
+
+
+def build_schedule_rows(users, week_days, shifts):
+    # Показываем только активных (если поля нет — считаем активным)
+    users = [u for u in users if u.get("is_active", True)]
+
+    columns = ["ФИО"] + [f"{day['weekday']} {day['date']}" for day in week_days]
+
+    # (user_id, date) -> slot за один проход; при дублях побеждает первая запись
+    by_user_day = {}
+    for s in shifts:
+        by_user_day.setdefault((s["user_id"], s["date"]), s["slot"])
+
+    # группировка по ролям за один проход (неизвестные и пустые роли -> "other")
+    buckets = {role: [] for role in ROLES_ORDER}
+    for u in users:
+        role = u.get("role")
+        buckets[role if role in ROLE_MAP else "other"].append(u)
+
+    data_rows = []
+    for role in ROLES_ORDER:
+        role_users = buckets[role]
+        if not role_users:
+            continue
+        data_rows.append([ROLE_MAP.get(role, "Другие")] + [""] * len(week_days))
+        for u in role_users:
+            uid = u["id"]
+            data_rows.append([u["name"]] + [by_user_day.get((uid, day["date_iso"]), "-") for day in week_days])
+    return columns, data_rows
+
+
+def make_schedule_image(users, week_days, shifts, fmt: str = "png", dpi: int = 170, quality: int = 85) -> bytes:
+    columns, data_rows = build_schedule_rows(users, week_days, shifts)
+
+    n_cols = len(columns)
+    n_rows = len(data_rows)
+    fig_w = min(max(2 + n_cols * 1.35, 8), 24)
+    fig_h = min(max(1.8 + n_rows * 0.7, 3), 28)
+    dpi = min(dpi, int(PHOTO_MAX_SIDES / (fig_w + fig_h)))
+    fig, ax = plt.subplots(figsize=(fig_w, fig_h))
+    ax.axis('off')
+    table = ax.table(cellText=data_rows, colLabels=columns, cellLoc='center', loc='center', bbox=[0, 0, 1, 1])
+    table.auto_set_font_size(False)
+    table.set_fontsize(13)
+    table.auto_set_column_width(col=list(range(n_cols)))
+
+    for (row, col), cell in table.get_celld().items():
+        if row == 0:
+            cell.set_fontsize(14)
+            cell.set_text_props(weight="bold")
+            cell.set_facecolor("#e3ebfa")
+        elif col == 0 and row > 0 and data_rows[row - 1][0] in ROLE_HEADERS:
+            cell.set_facecolor("#FFD580")
+            cell.set_text_props(weight="bold", color="black")
+        else:
+            cell.set_facecolor("white")
+            cell.set_text_props(weight="normal", color="black")
+
+    plt.tight_layout()
+    buf = io.BytesIO()
+    plt.savefig(buf, format="png", bbox_inches='tight', transparent=True, dpi=dpi)
+    plt.close(fig)
+    if fmt == "png":
+        return buf.getvalue()
+    # webp/jpeg — перекодируем через Pillow, там же и quality
+    buf.seek(0)
+    return _encode(Image.open(buf).convert("RGBA"), fmt, dpi, quality)
+
+
+# ---------------- PILLOW RENDER ----------------
+# Та же таблица, но растром напрямую: ширины колонок считаются по метрикам
+# глифов (font.getlength, с кэшем по строке), без раскладки matplotlib
+# (ax.table + auto_set_column_width + tight_layout + bbox_inches="tight"
+# многократно измеряют текст каждой ячейки). Шрифт — DejaVu Sans из matplotlib,
+# размеры — как у matplotlib-версии при том же dpi.
+FONT_DIR = os.path.join(matplotlib.get_data_path(), "fonts", "ttf")
+HEADER_BG = "#e3ebfa"
+ROLE_BG = "#FFD580"
+
+
+@lru_cache(maxsize=64)
+def _font(bold: bool, size_pt: float, dpi: int) -> ImageFont.FreeTypeFont:
+    name = "DejaVuSans-Bold.ttf" if bold else "DejaVuSans.ttf"
+    return ImageFont.truetype(os.path.join(FONT_DIR, name), round(size_pt * dpi / 72))
+
+
+def _pil_layout(grid: list, role_rows: set, dpi: int):
+    # шрифты и геометрия таблицы при данном dpi: (шрифты, line, row_h, xs, size, style)
+    regular, bold = _font(False, 13, dpi), _font(True, 13, dpi)
+    header = _font(True, 14, dpi)
+    line = max(1, round(dpi / 72))
+    pad_x = regular.size * 3 // 4
+    row_h = round(regular.size * 2.4)
+
+    # стиль ячейки: (шрифт, фон); role-заголовок — только первая ячейка строки, как в matplotlib
+    def style(r: int, c: int):
+        if r == 0:
+            return header, HEADER_BG
+        if c == 0 and r in role_rows:
+            return bold, ROLE_BG
+        return regular, "white"
+
+    widths = [0] * len(grid[0])
+    lengths = {}
+    for r, row in enumerate(grid):
+        for c, text in enumerate(row):
+            font = style(r, c)[0]
+            key = (text, id(font))
+            if key not in lengths:
+                lengths[key] = font.getlength(text)
+            widths[c] = max(widths[c], lengths[key])
+    widths = [round(w) + 2 * pad_x for w in widths]
+
+    margin = line * 4
+    xs = [margin]
+    for w in widths:
+        xs.append(xs[-1] + w)
+    size = (xs[-1] + margin, margin * 2 + row_h * len(grid))
+    return line, row_h, margin, xs, size, style
+
+
+def make_schedule_image_pil(users, week_days, shifts, fmt: str = "png", dpi: int = 170, quality: int = 85) -> bytes:
+    columns, data_rows = build_schedule_rows(users, week_days, shifts)
+    grid = [columns] + data_rows
+    role_rows = {r for r, row in enumerate(grid) if r and row[0] in ROLE_HEADERS}
+    line, row_h, margin, xs, size, style = _pil_layout(grid, role_rows, dpi)
+    # как fig_h у matplotlib: большая команда не должна выйти за лимит sendPhoto —
+    # уменьшаем dpi (размеры почти линейны по нему), пока не влезет
+    while sum(size) > PHOTO_MAX_SIDES and dpi > 20:
+        dpi = max(20, min(dpi - 1, int(dpi * PHOTO_MAX_SIDES / sum(size))))
+        line, row_h, margin, xs, size, style = _pil_layout(grid, role_rows, dpi)
+
+    img = Image.new("RGBA", size, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(img)
+    # слоты повторяются сотни раз — каждую строку растеризуем один раз и дальше
+    # только накладываем готовую маску
+    masks = {}
+    for r, row in enumerate(grid):
+        y = margin + r * row_h
+        for c, text in enumerate(row):
+            font, bg = style(r, c)
+            draw.rectangle((xs[c], y, xs[c + 1], y + row_h), fill=bg, outline="black", width=line)
+            if not text:
+                continue
+            key = (text, id(font))
+            if key not in masks:
+                left, top, right, bottom = font.getbbox(text, anchor="mm")
+                mask = Image.new("L", (right - left, bottom - top), 0)
+                ImageDraw.Draw(mask).text((-left, -top), text, font=font, fill=255, anchor="mm")
+                masks[key] = (mask, left, top)
+            mask, left, top = masks[key]
+            cx, cy = (xs[c] + xs[c + 1]) // 2, y + row_h // 2
+            img.paste((0, 0, 0, 255), (cx + left, cy + top), mask)
+
+    return _encode(img, fmt, dpi, quality)
+
+
+# Движки рендера расписания: SCHEDULE_ENGINE в .env
+RENDER_ENGINES = {
+    "matplotlib": make_schedule_image,
+    "pillow": make_schedule_image_pil,
+}
+
+
+# ---------------- RENDER SERVICE ----------------
+# Рендер идёт в отдельных процессах: matplotlib держит CPU сотни миллисекунд
+# и не должен останавливать event loop. Очередь ограничена: когда все воркеры
+# заняты, запрос ждёт; когда переполнена и очередь — RenderQueueFull.
+# Воркеры запускаются через fork: им не нужно заново импортировать ни
+# matplotlib, ни __main__ бота (spawn/forkserver перезапустили бы весь bot.py
+# в каждом воркере). fork многопоточного процесса может унаследовать чужие
+# захваченные локи, поэтому start() зовётся при импорте bot.py, пока потоков
+# ещё нет, и сразу форкает все воркеры. Где fork нет — spawn.
+class RenderQueueFull(Exception):
+    pass
+
+
+def _mp_context():
+    if "fork" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("fork")
+    return multiprocessing.get_context("spawn")
+
+
+class RenderService:
+    def __init__(self, workers: int = 2, queue_size: int = 16):
+        self.workers = workers
+        self.queue_size = queue_size
+        self._pool = None
+        self._slots = None
+        self._pending = 0
+
+    @property
+    def pending(self) -> int:
+        # рендерятся + ждут в очереди
+        return self._pending
+
+    @property
+    def busy(self) -> bool:
+        # все воркеры заняты — новый запрос встанет в очередь
+        return self._pending >= self.workers
+
+    def start(self):
+        if self._pool is None:
+            ctx = _mp_context()
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=ctx)
+            self._slots = asyncio.Semaphore(self.workers)
+            if ctx.get_start_method() == "fork":
+                # с fork пул запускает все воркеры на первой задаче — пусть это
+                # случится сейчас, а не когда появятся потоки
+                self._pool.submit(os.getpid)
+
+    async def warm_up(self):
+        # дожидается воркеров на старте бота, чтобы первый рендер не ждал
+        # их запуска (для spawn — ещё и импорта matplotlib)
+        self.start()
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self._pool, os.getpid) for _ in range(self.workers)))
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    async def render(self, fn, *args, **kwargs):
+        if self._pending >= self.workers + self.queue_size:
+            raise RenderQueueFull()
+        self.start()
+        self._pending += 1
+        try:
+            async with self._slots:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self._pool, partial(fn, *args, **kwargs))
+        finally:
+            self._pending -= 1
@@ -0,0 +1,312 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from cache import TTLCache
+
+
+# ---------------- DATA ACCESS ----------------
+# Синхронный клиент supabase выполняется в отдельном пуле потоков:
+# event loop aiogram не блокируется на сетевых запросах, а httpx-сессия
+# клиента (и её пул соединений) переиспользуется всеми потоками.
+# listeners — колбэки (table, op, rows, team_id), которые вызываются после каждой
+# записи со строками из ответа: через них обновляются кэши и счётчики команды.
+# Пользователи (по telegram_id) и команды кэшируются в процессе: чтения идут
+# из кэша, а собственные записи бота обновляют его строками из ответа.
+# observers — колбэки (table, op, query, rows, seconds, error) на каждый запрос
+# (метрики, трассировка); при ошибке rows = None.
+class Repo:
+    def __init__(self, client, workers: int = 8, cache_ttl: float = 300, cache_size: int = 10000):
+        self.client = client
+        self.listeners = []
+        self.observers = []
+        self.users = TTLCache(cache_ttl, cache_size)       # telegram_id -> строка users
+        self.teams = TTLCache(cache_ttl, cache_size)       # team_id -> строка teams
+        self.weeks = TTLCache(cache_ttl, cache_size)       # team_id -> активная неделя ({} — нет недели)
+        self._tg_by_id = TTLCache(cache_ttl, cache_size)   # users.id -> telegram_id
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="db")
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _execute(self, table: str, op: str, query):
+        loop = asyncio.get_running_loop()
+        t0 = time.perf_counter()
+        try:
+            resp = await loop.run_in_executor(self._executor, query.execute)
+        except Exception as e:
+            self._observe(table, op, query, None, time.perf_counter() - t0, e)
+            raise
+        self._observe(table, op, query, resp.data or [], time.perf_counter() - t0)
+        return resp
+
+    async def _run(self, table: str, op: str, query, team_id: str = None):
+        rows = (await self._execute(table, op, query)).data or []
+        if op not in ("select", "rpc"):
+            self._changed(table, op, rows, team_id)
+        return rows
+
+    def _observe(self, table: str, op: str, query, rows, seconds: float, error=None):
+        for observer in self.observers:
+            observer(table, op, query, rows, seconds, error)
+
+    def _changed(self, table: str, op: str, rows: list, team_id: str = None):
+        for listener in self.listeners:
+            listener(table, op, rows, team_id)
+
+    @staticmethod
+    def _first(rows: list):
+        return rows[0] if rows else None
+
+    def _cache_users(self, rows: list):
+        for r in rows:
+            if r.get("telegram_id") is not None:
+                self.users.put(r["telegram_id"], r)
+                self._tg_by_id.put(r["id"], r["telegram_id"])
+
+    # --- users ---
+    async def get_user_by_tg(self, telegram_id: int):
+        row = self.users.get(telegram_id)
+        if row is None:
+            q = self.client.table("users").select("*").eq("telegram_id", telegram_id)
+            row = self._first(await self._run("users", "select", q))
+            if row is None:
+                return None
+            self._cache_users([row])
+        return dict(row)
+
+    async def create_user(self, row: dict):
+        q = self.client.table("users").insert(row)
+        rows = await self._run("users", "insert", q)
+        self._cache_users(rows)
+        return self._first(rows)
+
+    async def update_user_by_tg(self, telegram_id: int, fields: dict) -> list:
+        q = self.client.table("users").update(fields).eq("telegram_id", telegram_id)
+        self.users.pop(telegram_id)
+        rows = await self._run("users", "update", q)
+        self._cache_users(rows)
+        return rows
+
+    async def get_team_member(self, user_id: str, team_id: str):
+        tg = self._tg_by_id.get(user_id)
+        row = self.users.get(tg) if tg is not None else None
+        if row is None:
+            q = self.client.table("users").select("*").eq("id", user_id).eq("team_id", team_id)
+            row = self._first(await self._run("users", "select", q))
+            if row is None:
+                return None
+            self._cache_users([row])
+        return dict(row) if row.get("team_id") == team_id else None
+
+    async def update_user(self, user_id: str, fields: dict, team_id: str = None) -> list:
+        q = self.client.table("users").update(fields).eq("id", user_id)
+        if team_id is not None:
+            q = q.eq("team_id", team_id)
+        tg = self._tg_by_id.pop(user_id)
+        if tg is not None:
+            self.users.pop(tg)
+        rows = await self._run("users", "update", q, team_id=team_id)
+        self._cache_users(rows)
+        return rows
+
+    async def list_team_users(self, team_id: str, columns: str = "*", order: str = None) -> list:
+        q = self.client.table("users").select(columns).eq("team_id", team_id)
+        if order:
+            q = q.order(order)
+        return await self._run("users", "select", q)
+
+    # Постраничный список по ключу (name, id): страница — один запрос с limit,
+    # без offset и без загрузки всей команды. after — (name, id) последней строки
+    # предыдущей страницы (вперёд), before — первой строки следующей (назад).
+    # Возвращает до limit + 1 строк в порядке (name, id): лишняя строка значит,
+    # что дальше (в направлении запроса) есть ещё.
+    async def list_team_users_page(self, team_id: str, columns: str = "*", limit: int = 10,
+                                   after: tuple = None, before: tuple = None, prefix: str = None) -> list:
+        desc = before is not None
+        q = self.client.table("users").select(columns).eq("team_id", team_id)
+        if prefix:
+            q = q.ilike("name", _like_prefix(prefix))
+        cursor = before if desc else after
+        if cursor is not None:
+            op = "lt" if desc else "gt"
+            name, uid = (_pg_quote(v) for v in cursor)
+            q = q.or_(f"name.{op}.{name},and(name.eq.{name},id.{op}.{uid})")
+        q = q.order("name", desc=desc).order("id", desc=desc).limit(limit + 1)
+        rows = await self._run("users", "select", q)
+        if desc:
+            # limit + 1-я строка (если есть) — признак предыдущих страниц; остальное — по возрастанию
+            head, rows = rows[limit:], rows[:limit][::-1]
+            return head + rows
+        return rows
+
+    async def count_team_users(self, team_id: str, prefix: str = None) -> int:
+        q = self.client.table("users").select("id", count="exact", head=True).eq("team_id", team_id)
+        if prefix:
+            q = q.ilike("name", _like_prefix(prefix))
+        return (await self._execute("users", "select", q)).count or 0
+
+    # --- teams ---
+    async def create_team(self, row: dict):
+        q = self.client.table("teams").insert(row)
+        team = self._first(await self._run("teams", "insert", q))
+        if team:
+            self.teams.put(team["id"], team)
+        return team
+
+    async def get_team(self, team_id: str):
+        team = self.teams.get(team_id)
+        if team is None:
+            q = self.client.table("teams").select("*").eq("id", team_id)
+            team = self._first(await self._run("teams", "select", q))
+            if team is None:
+                return None
+            self.teams.put(team_id, team)
+        return dict(team)
+
+    async def get_team_by_invite(self, invite_code: str, columns: str = "id,name"):
+        q = self.client.table("teams").select(columns).eq("invite_code", invite_code)
+        return self._first(await self._run("teams", "select", q))
+
+    async def update_team(self, team_id: str, fields: dict) -> list:
+        q = self.client.table("teams").update(fields).eq("id", team_id)
+        self.teams.pop(team_id)
+        rows = await self._run("teams", "update", q)
+        for team in rows:
+            self.teams.put(team["id"], team)
+        return rows
+
+    # --- weeks ---
+    async def get_active_week(self, team_id: str):
+        week = self.weeks.get(team_id)
+        if week is None:
+            q = self.client.table("weeks").select("*").eq("team_id", team_id).eq("is_active", True)
+            week = self._first(await self._run("weeks", "select", q)) or {}
+            self.weeks.put(team_id, week)
+        return dict(week) if week else None
+
+    def invalidate_week(self, team_id: str):
+        self.weeks.pop(team_id)
+
+    async def set_active_week(self, team_id: str, start_date: str, end_date: str):
+        self.invalidate_week(team_id)
+        q = self.client.table("weeks").update({"is_active": False}).eq("team_id", team_id).eq("is_active", True)
+        await self._run("weeks", "update", q, team_id=team_id)
+        q = self.client.table("weeks").insert({
+            "team_id": team_id,
+            "start_date": start_date,
+            "end_date": end_date,
+            "is_active": True,
+            "is_frozen": False,
+        })
+        week = self._first(await self._run("weeks", "insert", q))
+        if week:
+            self.weeks.put(team_id, week)
+        return week
+
+    async def update_week(self, week_id, fields: dict) -> list:
+        q = self.client.table("weeks").update(fields).eq("id", week_id)
+        rows = await self._run("weeks", "update", q)
+        for week in rows:
+            self.invalidate_week(week["team_id"])
+            if week.get("is_active"):
+                self.weeks.put(week["team_id"], week)
+        return rows
+
+    # --- shifts ---
+    async def list_shifts(self, team_id: str, date_from: str, date_to: str,
+                          columns: str = "user_id,date,slot") -> list:
+        # только строки нужного диапазона дат (индекс team_id, date), а не вся история команды
+        q = self.client.table("shifts").select(columns).eq("team_id", team_id) \
+            .gte("date", date_from).lte("date", date_to)
+        return await self._run("shifts", "select", q)
+
+    async def upsert_shifts(self, rows: list) -> list:
+        # одна запись на сотрудника в день: ключ (team_id, user_id, date); пачка — один запрос
+        if not rows:
+            return []
+        q = self.client.table("shifts").upsert(rows, on_conflict="team_id,user_id,date")
+        return await self._run("shifts", "upsert", q)
+
+    async def book_shift(self, team_id: str, user_id: str, date: str, slot: str) -> dict:
+        # проверка недели и лимита + upsert смены одной транзакцией (sql/002, sql/004);
+        # ответ: {ok, role, taken, max_count, daily}; при отказе reason = week | frozen | limit
+        q = self.client.rpc("book_shift", {
+            "p_team_id": team_id, "p_user_id": user_id, "p_date": date, "p_slot": slot,
+        })
+        res = await self._run("shifts", "rpc", q, team_id=team_id)
+        if res.get("reason") in ("week", "frozen"):
+            # кэш недели этого процесса устарел (неделю сменили/заморозили в другой реплике)
+            self.invalidate_week(team_id)
+        if res.get("ok"):
+            self._changed("shifts", "upsert",
+                          [{"team_id": team_id, "user_id": user_id, "date": date, "slot": slot}], team_id)
+        return res
+
+    async def delete_shift(self, team_id: str, user_id: str, date: str) -> list:
+        q = self.client.table("shifts").delete().eq("user_id", user_id).eq("team_id", team_id).eq("date", date)
+        return await self._run("shifts", "delete", q, team_id=team_id)
+
+    async def delete_shifts(self, team_id: str, keys: list) -> list:
+        # пачка удалений [(user_id, date)] — один запрос: or=(and(date.eq.…,user_id.in.(…)),…),
+        # по группе на дату, чтобы URL не рос с каждым сотрудником
+        if not keys:
+            return []
+        by_date = {}
+        for user_id, date in keys:
+            by_date.setdefault(date, []).append(_pg_quote(user_id))
+        cond = ",".join(f"and(date.eq.{d},user_id.in.({','.join(ids)}))" for d, ids in sorted(by_date.items()))
+        q = self.client.table("shifts").delete().eq("team_id", team_id).or_(cond)
+        return await self._run("shifts", "delete", q, team_id=team_id)
+
+    # --- limits ---
+    async def list_limits(self, team_id: str, date: str = None, role: str = None,
+                          date_from: str = None, date_to: str = None,
+                          columns: str = "slot,role,max_count") -> list:
+        q = self.client.table("limits").select(columns).eq("team_id", team_id)
+        if date is not None:
+            q = q.eq("date", date)
+        if date_from is not None:
+            q = q.gte("date", date_from)
+        if date_to is not None:
+            q = q.lte("date", date_to)
+        if role is not None:
+            q = q.eq("role", role)
+        return await self._run("limits", "select", q)
+
+    async def upsert_limits(self, rows: list) -> list:
+        # ключ (team_id, date, slot, role); дневной лимит — slot=None (sql/003_limits_key.sql)
+        if not rows:
+            return []
+        q = self.client.table("limits").upsert(rows, on_conflict="team_id,date,slot,role")
+        return await self._run("limits", "upsert", q)
+
+    async def copy_limits(self, team_id: str, date_from: str, date_to: str, weeks: int = 1) -> int:
+        # одно чтение исходного диапазона + один upsert на все целевые недели
+        rows = await self.list_limits(team_id, date_from=date_from, date_to=date_to,
+                                      columns="date,slot,role,max_count")
+        batch = []
+        for w in range(1, weeks + 1):
+            for r in rows:
+                batch.append({
+                    "team_id": team_id,
+                    "date": (datetime.strptime(r["date"], "%Y-%m-%d").date() + timedelta(days=7 * w)).isoformat(),
+                    "slot": r["slot"],  # может быть None
+                    "role": r["role"],
+                    "max_count": r["max_count"],
+                })
+        await self.upsert_limits(batch)
+        return len(batch)
+
+
+def _pg_quote(value) -> str:
+    # значение в логическом фильтре postgrest (or=(...)): в кавычках, чтобы запятые
+    # и скобки в имени не ломали разбор
+    return '"' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def _like_prefix(prefix: str) -> str:
+    # поиск по началу имени без учёта регистра; спецсимволы шаблона экранируем
+    escaped = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_").replace("*", "")
+    return escaped + "%"
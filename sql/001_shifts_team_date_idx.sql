@@ -0,0 +1,2 @@
+-- Выборка смен недели: eq(team_id) + диапазон по date
+create index if not exists shifts_team_date_idx on public.shifts (team_id, date);
@@ -0,0 +1,78 @@
+-- Бронирование смены одной операцией: проверка лимита и запись смены
+-- выполняются в одной транзакции под блокировкой (team_id, date), поэтому
+-- одновременные нажатия не могут превысить max_count.
+
+-- Одна запись на сотрудника в день. Перед созданием индекса убираем дубли,
+-- иначе индекс не создастся. Остаётся строка с наименьшим id: выбор
+-- детерминированный, но не «самая ранняя» — у shifts нет времени создания,
+-- а uuid порядок не отражает. Удаляемые копии сначала сохраняются в
+-- shifts_dedup_backup: проверь их и удали таблицу вручную.
+create table if not exists public.shifts_dedup_backup (like public.shifts);
+
+insert into public.shifts_dedup_backup
+select a.* from public.shifts a
+ where exists (select 1 from public.shifts b
+                where b.team_id = a.team_id and b.user_id = a.user_id and b.date = a.date
+                  and b.id < a.id);
+
+delete from public.shifts a
+ using public.shifts b
+ where a.team_id = b.team_id and a.user_id = b.user_id and a.date = b.date
+   and a.id > b.id;
+
+create unique index if not exists shifts_team_user_date_uidx
+    on public.shifts (team_id, user_id, date);
+
+create or replace function public.book_shift(p_team_id uuid, p_user_id uuid, p_date date, p_slot text)
+returns json
+language plpgsql
+as $$
+declare
+    v_role  text;
+    v_max   int;
+    v_daily boolean := false;
+    v_taken int := 0;
+begin
+    -- все бронирования команды на один день выполняются строго по очереди
+    perform pg_advisory_xact_lock(hashtext(p_team_id::text || ':' || p_date::text));
+
+    -- выходной лимитами не ограничивается
+    if p_slot not in ('-', 'вых', 'выходной') then
+        select role into v_role from public.users where id = p_user_id;
+
+        -- приоритет у лимита на слот, иначе дневной (slot is null)
+        select max_count into v_max from public.limits
+         where team_id = p_team_id and date = p_date and role = v_role and slot = p_slot
+         limit 1;
+        if v_max is null then
+            select max_count into v_max from public.limits
+             where team_id = p_team_id and date = p_date and role = v_role and slot is null
+             limit 1;
+            v_daily := v_max is not null;
+        end if;
+
+        if v_max is not null then
+            select count(*) into v_taken
+              from public.shifts s
+              join public.users u on u.id = s.user_id
+             where s.team_id = p_team_id and s.date = p_date and s.user_id <> p_user_id
+               and u.role = v_role and coalesce(u.is_active, true)
+               and case when v_daily
+                        then coalesce(trim(s.slot), '') not in ('-', 'вых', 'выходной')
+                        else s.slot = p_slot
+                   end;
+            if v_taken >= v_max then
+                return json_build_object('ok', false, 'role', v_role, 'taken', v_taken,
+                                         'max_count', v_max, 'daily', v_daily);
+            end if;
+        end if;
+    end if;
+
+    insert into public.shifts (team_id, user_id, date, slot)
+    values (p_team_id, p_user_id, p_date, p_slot)
+    on conflict (team_id, user_id, date) do update set slot = excluded.slot;
+
+    return json_build_object('ok', true, 'role', v_role, 'taken', v_taken,
+                             'max_count', v_max, 'daily', v_daily);
+end;
+$$;
@@ -0,0 +1,21 @@
+-- Естественный ключ лимита: (team_id, date, slot, role). Дневной лимит хранится
+-- со slot = null, поэтому индекс nulls not distinct (Postgres 15+) — иначе
+-- upsert по on_conflict не найдёт существующий дневной лимит.
+-- Дубли убираем явно: остаётся строка с наименьшим id (ctid — случайная
+-- физическая строка), удаляемые сохраняются в limits_dedup_backup.
+create table if not exists public.limits_dedup_backup (like public.limits);
+
+insert into public.limits_dedup_backup
+select a.* from public.limits a
+ where exists (select 1 from public.limits b
+                where b.team_id = a.team_id and b.date = a.date and b.role = a.role
+                  and b.slot is not distinct from a.slot and b.id < a.id);
+
+delete from public.limits a
+ using public.limits b
+ where a.team_id = b.team_id and a.date = b.date and a.role = b.role
+   and a.slot is not distinct from b.slot
+   and a.id > b.id;
+
+create unique index if not exists limits_team_date_slot_role_uidx
+    on public.limits (team_id, date, slot, role) nulls not distinct;
@@ -0,0 +1,77 @@
+-- book_shift проверяет ещё и неделю: дата должна входить в активную неделю
+-- команды, а в замороженную неделю бронировать могут только админы/владельцы.
+-- Раньше это проверял только бот по своему кэшу недели, который у других
+-- реплик отстаёт до USER_CACHE_TTL. Отказ: {ok: false, reason: week | frozen};
+-- отказ по лимиту — reason = limit, остальные поля как раньше.
+
+create or replace function public.book_shift(p_team_id uuid, p_user_id uuid, p_date date, p_slot text)
+returns json
+language plpgsql
+as $$
+declare
+    v_frozen boolean;
+    v_admin  boolean;
+    v_role  text;
+    v_max   int;
+    v_daily boolean := false;
+    v_taken int := 0;
+begin
+    -- все бронирования команды на один день выполняются строго по очереди
+    perform pg_advisory_xact_lock(hashtext(p_team_id::text || ':' || p_date::text));
+
+    -- день должен быть в активной неделе, а неделя — не заморожена (админам можно):
+    -- кэш недели у реплик бота может отставать, решает база
+    select w.is_frozen into v_frozen from public.weeks w
+     where w.team_id = p_team_id and w.is_active and p_date between w.start_date and w.end_date
+     limit 1;
+    if not found then
+        return json_build_object('ok', false, 'reason', 'week');
+    end if;
+    if coalesce(v_frozen, false) then
+        select coalesce(is_admin, false) or coalesce(is_owner, false) into v_admin
+          from public.users where id = p_user_id;
+        if not coalesce(v_admin, false) then
+            return json_build_object('ok', false, 'reason', 'frozen');
+        end if;
+    end if;
+
+    -- выходной лимитами не ограничивается
+    if p_slot not in ('-', 'вых', 'выходной') then
+        select role into v_role from public.users where id = p_user_id;
+
+        -- приоритет у лимита на слот, иначе дневной (slot is null)
+        select max_count into v_max from public.limits
+         where team_id = p_team_id and date = p_date and role = v_role and slot = p_slot
+         limit 1;
+        if v_max is null then
+            select max_count into v_max from public.limits
+             where team_id = p_team_id and date = p_date and role = v_role and slot is null
+             limit 1;
+            v_daily := v_max is not null;
+        end if;
+
+        if v_max is not null then
+            select count(*) into v_taken
+              from public.shifts s
+              join public.users u on u.id = s.user_id
+             where s.team_id = p_team_id and s.date = p_date and s.user_id <> p_user_id
+               and u.role = v_role and coalesce(u.is_active, true)
+               and case when v_daily
+                        then coalesce(trim(s.slot), '') not in ('-', 'вых', 'выходной')
+                        else s.slot = p_slot
+                   end;
+            if v_taken >= v_max then
+                return json_build_object('ok', false, 'reason', 'limit', 'role', v_role, 'taken', v_taken,
+                                         'max_count', v_max, 'daily', v_daily);
+            end if;
+        end if;
+    end if;
+
+    insert into public.shifts (team_id, user_id, date, slot)
+    values (p_team_id, p_user_id, p_date, p_slot)
+    on conflict (team_id, user_id, date) do update set slot = excluded.slot;
+
+    return json_build_object('ok', true, 'role', v_role, 'taken', v_taken,
+                             'max_count', v_max, 'daily', v_daily);
+end;
+$$;
@@ -0,0 +1,118 @@
+import asyncio
+import json
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Mapping
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage, SimpleEventIsolation
+
+
+def _dumps(obj) -> str:
+    # компактный JSON: без пробелов, кириллица как есть
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+# ---------------- SQLITE FSM STORAGE ----------------
+# Состояния диалогов в файле SQLite: переживают перезапуск бота. Файл — для
+# одного процесса: изоляция событий внутрипроцессная, и апдейты одного чата в
+# разных процессах читали бы и перезаписывали данные друг друга. Запись живёт
+# ttl секунд с последнего изменения; просроченные читаются как пустые и
+# периодически чистятся.
+class SQLiteStorage(BaseStorage):
+    PURGE_EVERY = 500   # операций записи между чистками просроченных строк
+
+    def __init__(self, path: str = "fsm.sqlite3", ttl: float = 86400):
+        self.ttl = ttl
+        self.key_builder = DefaultKeyBuilder(with_destiny=True)
+        self._writes = 0
+        # один поток — одно соединение: sqlite3 не любит делить соединение между потоками
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fsm")
+        self._conn = None
+        self._executor.submit(self._open, path).result()
+
+    def _open(self, path: str):
+        self._conn = sqlite3.connect(path, timeout=10)
+        self._conn.execute("pragma journal_mode=wal")
+        self._conn.execute("pragma synchronous=normal")
+        self._conn.execute(
+            "create table if not exists fsm ("
+            " key text primary key, state text, data text, expires real not null)"
+        )
+        self._conn.commit()
+
+    async def _call(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(fn, *args))
+
+    def _read(self, key: str):
+        row = self._conn.execute("select state, data, expires from fsm where key = ?", (key,)).fetchone()
+        if row is None or row[2] < time.time():
+            return None, None
+        return row[0], row[1]
+
+    def _write(self, key: str, column: str, value):
+        now = time.time()
+        other = "data" if column == "state" else "state"
+        # у просроченной записи вторую колонку не воскрешаем
+        self._conn.execute(
+            f"insert into fsm (key, {column}, expires) values (?, ?, ?) "
+            f"on conflict(key) do update set {column} = excluded.{column}, "
+            f"{other} = case when fsm.expires < ? then null else fsm.{other} end, "
+            f"expires = excluded.expires",
+            (key, value, now + self.ttl, now),
+        )
+        # пустой диалог не храним
+        self._conn.execute("delete from fsm where key = ? and state is null and data is null", (key,))
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            self._conn.execute("delete from fsm where expires < ?", (time.time(),))
+        self._conn.commit()
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        value = state.state if isinstance(state, State) else state
+        await self._call(self._write, self.key_builder.build(key), "state", value)
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        state, _ = await self._call(self._read, self.key_builder.build(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        value = _dumps(dict(data)) if data else None
+        await self._call(self._write, self.key_builder.build(key), "data", value)
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        _, data = await self._call(self._read, self.key_builder.build(key))
+        return json.loads(data) if data else {}
+
+    async def close(self) -> None:
+        if self._conn is not None:
+            await self._call(self._conn.close)
+            self._conn = None
+        self._executor.shutdown(wait=False)
+
+
+# ---------------- FACTORY ----------------
+# FSM_STORAGE: memory (по умолчанию) | sqlite | redis.
+# Апдейты одного чата обрабатываются по очереди: хендлеры читают данные FSM,
+# меняют и пишут обратно (редактор недели и т. п.), параллельно правки терялись бы.
+# memory/sqlite — внутрипроцессная изоляция; redis (нужен пакет redis) — общая
+# для реплик.
+def make_fsm_storage(kind: str, ttl: float, sqlite_path: str = None, redis_url: str = None):
+    kind = (kind or "memory").lower()
+    if kind == "memory":
+        return MemoryStorage(), SimpleEventIsolation()
+    if kind == "sqlite":
+        return SQLiteStorage(sqlite_path or "fsm.sqlite3", ttl=ttl), SimpleEventIsolation()
+    if kind == "redis":
+        from aiogram.fsm.storage.redis import RedisEventIsolation, RedisStorage
+        storage = RedisStorage.from_url(
+            redis_url or "redis://localhost:6379/0",
+            key_builder=DefaultKeyBuilder(with_destiny=True),
+            state_ttl=int(ttl), data_ttl=int(ttl), json_dumps=_dumps,
+        )
+        return storage, RedisEventIsolation(storage.redis, key_builder=storage.key_builder)
+    raise ValueError(f"Неизвестный FSM_STORAGE: {kind!r} (memory | sqlite | redis)")
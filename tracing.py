@@ -0,0 +1,82 @@
+import json
+import logging
+import time
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable
+from urllib.parse import unquote
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from middlewares import handler_name
+
+log = logging.getLogger("db_trace")
+
+_current: ContextVar = ContextVar("db_trace", default=None)
+
+
+# ---------------- DB QUERY TRACING ----------------
+# Включается DB_TRACE=1. На каждый апдейт — одна строка JSON в лог db_trace:
+#   {"update_id", "handler", "queries": [{table, op, filters, rows, ms}], "db_ms", "total_ms"}
+# Запросы собираются через Repo.observers в contextvar текущего апдейта, поэтому
+# видно и вложенные вызовы (например, btn_schedule из slot_choose_slot).
+def describe(query) -> list:
+    # фильтры запроса из параметров postgrest ("team_id=eq.…"); для rpc — аргументы
+    request = getattr(query, "request", None)
+    if request is None:
+        return []
+    params = getattr(request, "params", None) or []
+    items = params.multi_items() if hasattr(params, "multi_items") else list(params)
+    out = [f"{k}={unquote(str(v))}" for k, v in items if k not in ("select", "columns")]
+    body = getattr(request, "json", None)
+    if isinstance(body, dict) and "rpc/" in str(getattr(request, "path", "")):
+        out.extend(f"{k}={v}" for k, v in body.items())
+    return out
+
+
+def on_query(table: str, op: str, query, rows, seconds: float, error=None):
+    # для Repo.observers; вне апдейта (трасса не открыта) ничего не делает
+    trace = _current.get()
+    if trace is None:
+        return
+    entry = {"table": table, "op": op, "filters": describe(query),
+             "rows": None if rows is None else (len(rows) if isinstance(rows, list) else 1),
+             "ms": round(seconds * 1000, 1)}
+    if error is not None:
+        entry["error"] = type(error).__name__
+    trace["queries"].append(entry)
+
+
+# Внешний middleware на dp.update: открывает трассу апдейта и пишет её в лог.
+class TraceUpdate(BaseMiddleware):
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        trace = {"update_id": getattr(event, "update_id", None), "handler": None, "queries": []}
+        token = _current.set(trace)
+        t0 = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            _current.reset(token)
+            if trace["handler"] or trace["queries"]:
+                trace["db_ms"] = round(sum(q["ms"] for q in trace["queries"]), 1)
+                trace["total_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+                log.info(json.dumps(trace, ensure_ascii=False, default=str))
+
+
+# Внутренний middleware на dp.message / dp.callback_query: подписывает трассу именем хендлера.
+class TraceHandler(BaseMiddleware):
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        trace = _current.get()
+        if trace is not None and trace["handler"] is None:
+            trace["handler"] = handler_name(data)
+        return await handler(event, data)
@@ -0,0 +1,49 @@
+import logging
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+from middlewares import ConcurrencyLimit
+
+log = logging.getLogger(__name__)
+
+
+# ---------------- WEBHOOK SERVER ----------------
+# Альтернатива polling: Telegram сам присылает апдейты POST-запросами на
+# base_url + path. Запросы без верного X-Telegram-Bot-Api-Secret-Token
+# отклоняются (401). Несколько экземпляров за балансировщиком регистрируют
+# один и тот же URL — set_webhook идемпотентен.
+def build_app(dp: Dispatcher, bot: Bot, limiter: ConcurrencyLimit, *, base_url: str, path: str,
+              secret: str, drain_timeout: float = 30) -> web.Application:
+    app = web.Application()
+
+    async def on_startup(*_, **__):
+        await bot.set_webhook(
+            base_url.rstrip("/") + path,
+            secret_token=secret,
+            allowed_updates=dp.resolve_used_update_types(),
+        )
+        log.info("Webhook: %s%s", base_url.rstrip("/"), path)
+
+    async def on_shutdown(*_, **__):
+        # новые запросы сервер уже не принимает; дорабатываем принятые апдейты
+        # до закрытия сессии бота и хранилища FSM (их хуки идут следом)
+        if not await limiter.drain(drain_timeout):
+            log.warning("Webhook: остановка с %d необработанными апдейтами", limiter.pending)
+
+    # порядок важен: drain раньше закрытия сессии бота (SimpleRequestHandler)
+    # и dp.shutdown (setup_application)
+    app.on_shutdown.append(on_shutdown)
+    dp.startup.register(on_startup)
+    SimpleRequestHandler(dispatcher=dp, bot=bot, handle_in_background=True,
+                         secret_token=secret).register(app, path=path)
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+def run_webhook(dp: Dispatcher, bot: Bot, limiter: ConcurrencyLimit, *, base_url: str, path: str,
+                secret: str, host: str = "0.0.0.0", port: int = 8080):
+    app = build_app(dp, bot, limiter, base_url=base_url, path=path, secret=secret)
+    # SIGINT/SIGTERM обрабатывает aiohttp: перестаёт слушать порт и вызывает on_shutdown
+    web.run_app(app, host=host, port=port, print=None)